@@ -0,0 +1,376 @@
+"""
+A local stand-in for the SCC Firewall Manager API endpoints used by the CLI, for
+measuring its performance without touching a real MSSP portal. Point the CLI at it
+using `--region localhost`.
+
+    python benchmarks/mock_scc_api.py --tenants 50 --devices 20 --latency 0.05
+
+GET /_stats returns the number of requests served per endpoint.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+
+default_port = 3077
+device_models = ["FPR1010", "FPR1120", "FPR2110", "FPR3110", "FPR4112"]
+software_versions = ["7.0.6", "7.2.5", "7.2.8", "7.4.1"]
+compatible_versions = ["7.2.8", "7.4.1", "7.4.2", "7.6.0"]
+
+
+class MockSccApi:
+    """The state of the mock API: tenants, devices, users and transactions."""
+
+    def __init__(
+        self,
+        tenant_count: int,
+        device_count: int,
+        latency_seconds: float = 0.0,
+        jitter_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        quota_per_second: float = 0.0,
+        transaction_seconds: float = 0.5,
+        broken_tenant_count: int = 0,
+        broken_tenant_latency_seconds: float = 0.0,
+        seed: int = 0,
+    ):
+        self.device_count = device_count
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.error_rate = error_rate
+        self.quota_per_second = quota_per_second
+        self.transaction_seconds = transaction_seconds
+        self.random = random.Random(seed)
+        self.tenants = [
+            {
+                "uid": str(uuid.UUID(int=index + 1)),
+                "name": f"tenant{index}",
+                "displayName": f"Tenant {index}",
+                "region": "US",
+            }
+            for index in range(tenant_count)
+        ]
+        self.tenants_by_uid = {tenant["uid"]: tenant for tenant in self.tenants}
+        # the inventory of a broken tenant responds slowly, with a 503
+        self.broken_tenant_uids = {
+            tenant["uid"] for tenant in self.tenants[:broken_tenant_count]
+        }
+        self.broken_tenant_latency_seconds = broken_tenant_latency_seconds
+        self.users = {}
+        self.transactions = {}
+        self.stats = {"requests": 0, "throttled": 0, "injected_errors": 0}
+        self.lock = threading.Lock()
+        self._quota_tokens = quota_per_second
+        self._quota_refilled_at = time.monotonic()
+
+    def get_devices(self, tenant_uid: str) -> list:
+        # device attributes are derived from the tenant, so they are stable across runs
+        tenant_index = uuid.UUID(tenant_uid).int
+        return [
+            {
+                "uid": str(uuid.uuid5(uuid.UUID(tenant_uid), str(index))),
+                "name": f"ftd-{index}",
+                "deviceType": "CDFMC_MANAGED_FTD",
+                "connectivityState": "ONLINE",
+                "modelNumber": device_models[
+                    (tenant_index + index) % len(device_models)
+                ],
+                "softwareVersion": software_versions[index % len(software_versions)],
+            }
+            for index in range(self.device_count)
+        ]
+
+    def create_transaction(self, tenant_uid: str | None = None) -> dict:
+        transaction_uid = str(uuid.uuid4())
+        with self.lock:
+            self.transactions[transaction_uid] = (
+                time.monotonic() + self.transaction_seconds
+            )
+        return {
+            "transactionUid": transaction_uid,
+            "tenantUid": tenant_uid,
+            "cdoTransactionStatus": "PENDING",
+        }
+
+    def create_token(self, subject: str) -> str:
+        return jwt.encode(
+            {"sub": subject, "exp": int(time.time()) + 3600},
+            "mock-scc-api-signing-key-32-bytes",
+            algorithm="HS256",
+        )
+
+    def record_request(self, endpoint: str) -> None:
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def is_throttled(self) -> bool:
+        if not self.quota_per_second:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self._quota_tokens = min(
+                self.quota_per_second,
+                self._quota_tokens
+                + (now - self._quota_refilled_at) * self.quota_per_second,
+            )
+            self._quota_refilled_at = now
+            if self._quota_tokens >= 1:
+                self._quota_tokens -= 1
+                return False
+            self.stats["throttled"] += 1
+            return True
+
+    def should_inject_error(self) -> bool:
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                self.stats["injected_errors"] += 1
+                return True
+        return False
+
+    def sleep(self) -> None:
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_seconds, self.jitter_seconds)
+        time.sleep(max(0.0, self.latency_seconds + jitter))
+
+
+def get_endpoint(path: str) -> str:
+    return re.sub(r"/[0-9a-f]{8}-[0-9a-f-]{27}", "/{uid}", path)
+
+
+class MockSccApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api: MockSccApi
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def send_json(self, status: int, body: dict | None = None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def handle_request(self, method: str):
+        url = urlparse(self.path)
+        path = url.path.removeprefix("/firewall")
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = self.read_body() if method == "POST" else {}
+        if path == "/_stats":
+            with self.api.lock:
+                return self.send_json(200, dict(self.api.stats))
+
+        self.api.record_request(f"{method} {get_endpoint(path)}")
+        if self.api.is_throttled():
+            return self.send_json(429, {}, headers={"Retry-After": "1"})
+        self.api.sleep()
+        if self.api.should_inject_error():
+            return self.send_json(503, {"error": "Injected error"})
+        status, response = self.route(method, path, query, body)
+        self.send_json(status, response)
+
+    def route(self, method: str, path: str, query: dict, body: dict):
+        api = self.api
+        if path == "/v1/token":
+            return 200, {"name": "mock-msp-user", "tenantUid": str(uuid.UUID(int=0))}
+
+        if path == "/v1/msp/tenants" and method == "GET":
+            return 200, self.get_page(api.tenants, query)
+
+        match = re.fullmatch(r"/v1/msp/tenants/([^/]+)", path)
+        if match and method == "GET":
+            tenant = api.tenants_by_uid.get(match[1])
+            return (200, tenant) if tenant else (404, {"error": "Not found"})
+        if match and method == "POST":
+            return 202, api.create_transaction(match[1])
+
+        match = re.fullmatch(r"/v1/msp/tenants/([^/]+)/users/api-only", path)
+        if match:
+            username = query.get("q", "").removeprefix("name:")
+            user = api.users.get((match[1], username))
+            return 200, {"count": 1 if user else 0, "items": [user] if user else []}
+
+        match = re.fullmatch(r"/v1/msp/tenants/([^/]+)/users", path)
+        if match and method == "POST":
+            tenant = api.tenants_by_uid.get(match[1])
+            if tenant is None:
+                return 404, {"error": "Not found"}
+            with api.lock:
+                for user in body.get("users", []):
+                    username = f"{user['username']}@{tenant['name']}"
+                    api.users[(match[1], username)] = {
+                        "uid": str(uuid.uuid4()),
+                        "name": username,
+                        "apiOnlyUser": True,
+                    }
+            return 202, api.create_transaction(match[1])
+
+        match = re.fullmatch(r"/v1/msp/tenants/([^/]+)/users/([^/]+)/token", path)
+        if match:
+            return 201, {"apiToken": api.create_token(match[1])}
+
+        match = re.fullmatch(r"/v1/transactions/([^/]+)", path)
+        if match:
+            done_at = api.transactions.get(match[1])
+            if done_at is None:
+                return 404, {"error": "Not found"}
+            status = "DONE" if time.monotonic() >= done_at else "IN_PROGRESS"
+            return 200, {"transactionUid": match[1], "cdoTransactionStatus": status}
+
+        tenant_uid = self.get_tenant_uid()
+        if tenant_uid is None:
+            return 401, {"error": "Unauthorized"}
+        if tenant_uid in api.broken_tenant_uids:
+            time.sleep(api.broken_tenant_latency_seconds)
+            return 503, {"error": "Broken tenant"}
+
+        if path == "/v1/inventory/devices":
+            return 200, self.get_page(api.get_devices(tenant_uid), query)
+
+        match = re.fullmatch(
+            r"/v1/inventory/devices/ftds/([^/]+)/upgrades/versions", path
+        )
+        if match:
+            # every seventh device has no upgrade packages available
+            if zlib.crc32(match[1].encode()) % 7 == 0:
+                return 404, {"error": "Not found"}
+            return 200, {
+                "count": len(compatible_versions),
+                "items": [
+                    {
+                        "softwareVersion": version,
+                        "isSuggestedVersion": version == "7.4.2",
+                        "upgradePackageUid": str(
+                            uuid.uuid5(uuid.UUID(tenant_uid), version)
+                        ),
+                    }
+                    for version in compatible_versions
+                ],
+            }
+
+        match = re.fullmatch(
+            r"/v1/inventory/devices/ftds/([^/]+)/upgrades/trigger", path
+        )
+        if match and method == "POST":
+            return 202, api.create_transaction(tenant_uid)
+
+        return 404, {"error": f"No mock for {method} {path}"}
+
+    def get_tenant_uid(self) -> str | None:
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        try:
+            tenant_uid = jwt.decode(token, options={"verify_signature": False})["sub"]
+        except (jwt.InvalidTokenError, KeyError):
+            return None
+        return tenant_uid if tenant_uid in self.api.tenants_by_uid else None
+
+    @staticmethod
+    def get_page(items: list, query: dict) -> dict:
+        limit = int(query.get("limit", 50))
+        offset = int(query.get("offset", 0))
+        return {
+            "count": len(items),
+            "limit": limit,
+            "offset": offset,
+            "items": items[offset : offset + limit],
+        }
+
+
+def create_server(api: MockSccApi, port: int = default_port) -> ThreadingHTTPServer:
+    handler = type("RequestHandler", (MockSccApiRequestHandler,), {"api": api})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--devices", type=int, default=10, help="Devices per tenant.")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds added to each request."
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Random +/- seconds of latency."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that fail with a 503.",
+    )
+    parser.add_argument(
+        "--quota",
+        type=float,
+        default=0.0,
+        help="Requests per second above which requests are throttled with a 429 (0 for no quota).",
+    )
+    parser.add_argument(
+        "--transaction-seconds",
+        type=float,
+        default=0.5,
+        help="Seconds before a transaction is done.",
+    )
+    parser.add_argument(
+        "--broken-tenants",
+        type=int,
+        default=0,
+        help="The number of tenants whose inventory requests fail with a 503.",
+    )
+    parser.add_argument(
+        "--broken-tenant-latency",
+        type=float,
+        default=0.0,
+        help="Seconds before a broken tenant responds.",
+    )
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = create_server(
+        MockSccApi(
+            tenant_count=args.tenants,
+            device_count=args.devices,
+            latency_seconds=args.latency,
+            jitter_seconds=args.jitter,
+            error_rate=args.error_rate,
+            quota_per_second=args.quota,
+            transaction_seconds=args.transaction_seconds,
+            broken_tenant_count=args.broken_tenants,
+            broken_tenant_latency_seconds=args.broken_tenant_latency,
+            seed=args.seed,
+        ),
+        args.port,
+    )
+    print(f"Mock SCC API listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Runs CLI commands end to end against the mock SCC API and reports wall time,
+requests per second and peak memory for each, so that performance changes can be
+measured offline.
+
+    python benchmarks/run_benchmarks.py --tenants 50 --devices 20 --latency 0.05
+
+Each run starts a fresh mock server, on --port or else on a free port, and uses an
+empty home directory, so no caches are warm unless --warm is used. Results can be saved with --output and compared to
+a previous run with --baseline, which fails if any scenario got slower by more than
+--max-regression.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+import jwt
+from rich.console import Console
+from rich.table import Table
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+mock_server_path = os.path.join(repo_dir, "benchmarks", "mock_scc_api.py")
+# points the CLI's localhost region at the mock server's port
+localhost_port_env_var = "SCC_LOCALHOST_PORT"
+
+console = Console()
+
+
+@dataclass
+class BenchmarkResult:
+    scenario: str
+    wall_seconds: float
+    requests: int
+    requests_per_second: float
+    peak_memory_mib: float
+    exit_code: int
+
+
+def get_scenarios(work_dir: str, tenant_uids_file: str) -> Dict[str, List[str]]:
+    output_file = os.path.join(work_dir, "suggested-ftd-versions.csv")
+    return {
+        "get-suggested-ftd-versions": [
+            "--all",
+            "get-suggested-ftd-versions",
+            "--output-file",
+            output_file,
+        ],
+        "get-suggested-ftd-versions (concurrent)": [
+            "--all",
+            "get-suggested-ftd-versions",
+            "--output-file",
+            output_file,
+            "--tenant-concurrency",
+            "8",
+            "--device-concurrency",
+            "4",
+        ],
+        "add-tenants": [
+            "add-tenants",
+            "--tenant-uids",
+            tenant_uids_file,
+        ],
+        "add-tenants (pipelined)": [
+            "add-tenants",
+            "--tenant-uids",
+            tenant_uids_file,
+            "--in-flight",
+            "8",
+        ],
+    }
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    mock_server = subprocess.Popen(
+        [
+            sys.executable,
+            mock_server_path,
+            f"--port={port}",
+            f"--tenants={args.tenants}",
+            f"--devices={args.devices}",
+            f"--latency={args.latency}",
+            f"--jitter={args.jitter}",
+            f"--error-rate={args.error_rate}",
+            f"--quota={args.quota}",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        # e.g. if the port is already in use; otherwise another server on the port
+        # would be benchmarked instead
+        if mock_server.poll() is not None:
+            raise RuntimeError(
+                f"The mock SCC API server exited with code {mock_server.returncode}"
+            )
+        try:
+            get_request_count(port)
+            return mock_server
+        except OSError:
+            time.sleep(0.1)
+    mock_server.kill()
+    raise RuntimeError("The mock SCC API server did not start")
+
+
+def get_request_count(port: int) -> int:
+    with urllib.request.urlopen(
+        f"http://127.0.0.1:{port}/_stats", timeout=1
+    ) as response:
+        return json.load(response)["requests"]
+
+
+def run_cli(
+    cli_args: List[str], home_dir: str, port: int, verbose: bool
+) -> tuple[float, int, int]:
+    """Returns the wall time, exit code and peak RSS (in KiB) of one CLI run."""
+    msp_api_token = jwt.encode(
+        {"sub": "benchmark"}, "benchmark-signing-key-of-32-bytes", algorithm="HS256"
+    )
+    started_at = time.monotonic()
+    cli = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(repo_dir, "cli.py"),
+            "--region",
+            "localhost",
+            "--api-token",
+            msp_api_token,
+            *cli_args,
+        ],
+        cwd=repo_dir,
+        env={
+            **os.environ,
+            "HOME": home_dir,
+            "COLUMNS": "200",
+            localhost_port_env_var: str(port),
+        },
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL,
+    )
+    # wait4 reports the resource usage of this child only, not of the mock server
+    _, status, rusage = os.wait4(cli.pid, 0)
+    cli.returncode = os.waitstatus_to_exitcode(status)
+    return time.monotonic() - started_at, cli.returncode, rusage.ru_maxrss
+
+
+def run_scenario(
+    name: str, cli_args: List[str], args: argparse.Namespace, home_dir: str
+) -> BenchmarkResult:
+    port = args.port or get_free_port()
+    mock_server = start_mock_server(args, port)
+    try:
+        if not args.warm:
+            home_dir = tempfile.mkdtemp(dir=home_dir)
+        requests_before = get_request_count(port)
+        wall_seconds, exit_code, peak_memory_kib = run_cli(
+            cli_args, home_dir, port, args.verbose
+        )
+        requests = get_request_count(port) - requests_before
+    finally:
+        mock_server.terminate()
+        mock_server.wait()
+    return BenchmarkResult(
+        scenario=name,
+        wall_seconds=round(wall_seconds, 3),
+        requests=requests,
+        requests_per_second=round(requests / wall_seconds, 1),
+        peak_memory_mib=round(peak_memory_kib / 1024, 1),
+        exit_code=exit_code,
+    )
+
+
+def print_results(results: List[BenchmarkResult], baseline: Dict[str, dict]):
+    table = Table(title="Benchmark results")
+    for column in ["Scenario", "Wall (s)", "Requests", "Req/s", "Peak RSS (MiB)"]:
+        table.add_column(column, justify="left" if column == "Scenario" else "right")
+    if baseline:
+        table.add_column("vs baseline", justify="right")
+    for result in results:
+        row = [
+            result.scenario
+            + (f" (exit {result.exit_code})" if result.exit_code else ""),
+            f"{result.wall_seconds:.2f}",
+            str(result.requests),
+            f"{result.requests_per_second:.1f}",
+            f"{result.peak_memory_mib:.1f}",
+        ]
+        if baseline:
+            baseline_result = baseline.get(result.scenario)
+            row.append(
+                f"{get_regression(result, baseline_result):+.0%}"
+                if baseline_result
+                else "new"
+            )
+        table.add_row(*row)
+    console.print(table)
+
+
+def get_regression(result: BenchmarkResult, baseline_result: dict) -> float:
+    return result.wall_seconds / baseline_result["wall_seconds"] - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--devices", type=int, default=10, help="Devices per tenant.")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=float, default=0.0)
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=0,
+        help="The port to run the mock server on (default: a free port).",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="Only run scenarios whose name contains this (can be repeated).",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Share one home directory between runs, so later runs use warm caches.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--baseline", help="Compare against results saved with --output."
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Fail if a scenario's wall time grew by more than this fraction of the baseline.",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the output of the CLI."
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tenant_uids_file = os.path.join(work_dir, "tenant-uids.txt")
+        with open(tenant_uids_file, "w", encoding="utf-8") as file:
+            # the mock server generates tenant UIDs from their index
+            file.writelines(
+                f"00000000-0000-0000-0000-{index + 1:012x}\n"
+                for index in range(args.tenants)
+            )
+        scenarios = {
+            name: cli_args
+            for name, cli_args in get_scenarios(work_dir, tenant_uids_file).items()
+            if not args.scenario or any(filter in name for filter in args.scenario)
+        }
+        results = []
+        for name, cli_args in scenarios.items():
+            console.print(f"Running {name}...")
+            results.append(run_scenario(name, cli_args, args, work_dir))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = {result["scenario"]: result for result in json.load(file)}
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump([asdict(result) for result in results], file, indent=2)
+
+    regressions = [
+        result.scenario
+        for result in results
+        if result.scenario in baseline
+        and get_regression(result, baseline[result.scenario]) > args.max_regression
+    ]
+    failures = [result.scenario for result in results if result.exit_code != 0]
+    if regressions:
+        console.print(
+            f"Slower than the baseline: {', '.join(regressions)}", style="red"
+        )
+    if failures:
+        console.print(f"Failed: {', '.join(failures)}", style="red")
+    sys.exit(1 if regressions or failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measures how long the CLI takes to start, by timing `python cli.py --help`, and fails
+if its median overhead over starting a bare Python interpreter exceeds a budget. The
+CLI is often run in tight shell loops, so this cost is paid on every call.
+
+    python benchmarks/startup_time.py --runs 20 --budget-ms 150
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+console = Console()
+
+
+def time_command(command: list, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run(command, cwd=repo_dir, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=150,
+        help="The maximum median startup time of the CLI, on top of that of a bare interpreter.",
+    )
+    args = parser.parse_args()
+
+    # warm up the OS file cache, so that the first run isn't an outlier
+    time_command([sys.executable, "cli.py", "--help"], 1)
+    interpreter_timings = time_command([sys.executable, "-c", "pass"], args.runs)
+    cli_timings = time_command([sys.executable, "cli.py", "--help"], args.runs)
+
+    table = Table(title=f"Startup time over {args.runs} runs (ms)")
+    for column in ["Command", "Median", "Min", "Max"]:
+        table.add_column(column, justify="left" if column == "Command" else "right")
+    for command, timings in [
+        ("python -c pass", interpreter_timings),
+        ("python cli.py --help", cli_timings),
+    ]:
+        table.add_row(
+            command,
+            f"{statistics.median(timings) * 1000:.0f}",
+            f"{min(timings) * 1000:.0f}",
+            f"{max(timings) * 1000:.0f}",
+        )
+    console.print(table)
+
+    overhead_ms = (
+        statistics.median(cli_timings) - statistics.median(interpreter_timings)
+    ) * 1000
+    if overhead_ms > args.budget_ms:
+        console.print(
+            f"CLI startup overhead of {overhead_ms:.0f}ms exceeds the budget of {args.budget_ms:.0f}ms",
+            style="red",
+        )
+        sys.exit(1)
+    console.print(
+        f"CLI startup overhead of {overhead_ms:.0f}ms is within the budget of {args.budget_ms:.0f}ms",
+        style="green",
+    )
+
+
+if __name__ == "__main__":
+    main()
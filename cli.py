@@ -1,53 +1,140 @@
+from __future__ import annotations
+
 import csv
-from idlelib.pyparse import trans
-from typing import List, Tuple
+import itertools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from functools import cache
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple, TypeVar
 
 import click
-import questionary
 from click_option_group import optgroup, AllOptionGroup, MutuallyExclusiveOptionGroup
-from rich.console import Console, Group
-from rich.live import Live
-from rich.progress import (
-    Progress,
-    TextColumn,
-    BarColumn,
-    TaskID,
-    SpinnerColumn,
-    TimeElapsedColumn,
-)
-from rich.table import Table
-from scc_firewall_manager_sdk import (
-    ApiClient,
-    Configuration,
-    MSPApi,
-    Device,
-    MspManagedTenant,
-)
-from scc_firewall_manager_sdk.exceptions import (
-    UnauthorizedException,
-    ForbiddenException,
-)
-
-from services.device_upgrade_service import DeviceUpgradeService
-from services.inventory_api_service import InventoryApiService
-from services.msp_service import MspService
-from services.scc_credentials_service import SccCredentialsService
-from utils.region_mapping import supported_regions
 
-console = Console()
-overall_progress: Progress = Progress(
-    TextColumn("[progress.description]{task.description}({task.fields[tenant_name]})"),
-    BarColumn(),
-    TimeElapsedColumn(),
-    TextColumn("{task.percentage:>3.0f}%"),
+from utils.api_profiler import profile_formats
+from utils.checkpoint_journal import CheckpointJournal
+from utils.concurrency import ordered_map
+from utils.file_cache import FileCache
+from utils.inventory_store import (
+    InventoryStore,
+    default_inventory_db_path,
+    device_columns,
+    tenant_columns,
+    to_text_row,
 )
-per_tenant_progress: Progress = Progress(
-    TextColumn("[progress.description]{task.description}"),
-    SpinnerColumn(),
-    transient=True,
+from utils.output_writers import (
+    create_output_writer,
+    output_formats,
+    read_output_file,
+)
+from utils.region_mapping import supported_regions
+from utils.result_summary import SuggestedVersionSummary, not_found_version
+from utils.sharding import (
+    ShardManifest,
+    get_manifest_path,
+    get_shard_index,
+    parse_shard,
+    select_shard,
 )
-group = Group(overall_progress, per_tenant_progress)
-live = Live(group)
+from utils.upgrade_waves import DeviceUpgrade, plan_upgrade_waves
+
+# the SDK, rich and the services that use them take much longer to import than the
+# rest of the CLI, so they are only imported by the commands that use them
+if TYPE_CHECKING:
+    from rich.console import Console
+    from rich.progress import TaskID
+    from rich.table import Table
+    from scc_firewall_manager_sdk import ApiClient, Device, FtdVersion, MspManagedTenant
+
+    from services.compatible_version_cache import CompatibleVersionCache
+    from services.msp_service import MspService
+    from services.scc_credentials_service import SccCredentialsService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_profiler import ApiProfiler, EndpointStats
+
+T = TypeVar("T")
+
+
+@cache
+def get_console() -> Console:
+    from rich.console import Console
+
+    return Console()
+
+
+display_modes = ["full", "summary", "quiet"]
+display_mode = "full"
+
+
+class ProgressDisplay:
+    """
+    The progress bars shown while a command runs. In full mode, each device being
+    looked up gets its own line; in summary mode, each tenant in flight shows a count
+    of its devices instead, and the display is redrawn less often; in quiet mode,
+    nothing is shown.
+    """
+
+    def __init__(self, mode: str = "full"):
+        from rich.console import Group
+        from rich.live import Live
+        from rich.progress import (
+            BarColumn,
+            Progress,
+            SpinnerColumn,
+            TextColumn,
+            TimeElapsedColumn,
+        )
+
+        self.overall_progress: Progress = Progress(
+            TextColumn(
+                "[progress.description]{task.description}({task.fields[tenant_name]})"
+            ),
+            BarColumn(),
+            TimeElapsedColumn(),
+            TextColumn("{task.percentage:>3.0f}%"),
+        )
+        self.per_tenant_progress: Progress = Progress(
+            TextColumn("[progress.description]{task.description}"),
+            SpinnerColumn(),
+            *(
+                [TextColumn("{task.completed:.0f} devices")]
+                if mode == "summary"
+                else []
+            ),
+            transient=True,
+        )
+        self.mode = mode
+        self.live = (
+            Live(
+                Group(self.overall_progress, self.per_tenant_progress),
+                refresh_per_second=1 if mode == "summary" else 4,
+                console=get_console(),
+            )
+            if mode != "quiet"
+            else nullcontext()
+        )
+
+    def add_device_task(self, description: str) -> TaskID | None:
+        if self.mode != "full":
+            return None
+        return self.per_tenant_progress.add_task(description, start=True)
+
+    def remove_device_task(self, task_id: TaskID | None) -> None:
+        if task_id is not None:
+            self.per_tenant_progress.remove_task(task_id)
+
+
+@cache
+def get_progress_display() -> ProgressDisplay:
+    return ProgressDisplay(display_mode)
+
+
+# commands that work on local data only, and don't need API credentials
+offline_commands = ["query", "merge"]
 
 
 @click.group()
@@ -70,68 +157,374 @@ live = Live(group)
     type=bool,
     is_flag=True,
 )
+@click.option(
+    "--shard",
+    callback=lambda ctx, param, value: parse_shard_option(value),
+    help="Only process the tenants in shard i of N, such as 1/4. Tenants are assigned to shards by a hash of their UID, so N processes or hosts can each process one shard without coordinating.",
+)
+@click.option(
+    "--token-cache/--no-token-cache",
+    default=True,
+    show_default=True,
+    help="Reuse tenant API tokens cached in ~/.cisco-security-cache until they expire.",
+)
+@click.option(
+    "--tenant-cache-ttl",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Reuse the list of managed tenants for this many seconds after fetching it (0 disables the cache).",
+)
+@click.option(
+    "--connection-pool-size",
+    type=click.IntRange(min=1),
+    help="The number of connections to keep open to the API. Defaults to a size based on the concurrency options of the command.",
+)
+@click.option(
+    "--rate-limit",
+    type=click.FloatRange(min=0, min_open=True),
+    help="The maximum number of API requests to make per second. By default, requests are only slowed down when the API responds with 429 Too Many Requests.",
+)
+@click.option(
+    "--request-timeout",
+    type=click.FloatRange(min=0),
+    default=30,
+    show_default=True,
+    help="The number of seconds to wait for each API request before it is retried or fails (0 waits forever).",
+)
+@click.option(
+    "--max-retries",
+    type=click.IntRange(min=0),
+    default=3,
+    show_default=True,
+    help="The number of times to retry an API request that fails with a server or network error, backing off exponentially.",
+)
+@click.option(
+    "--tenant-failure-threshold",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Give up on a tenant, and record it as failed, after this many of its API requests in a row have failed with a server or network error.",
+)
+@click.option(
+    "--display",
+    type=click.Choice(display_modes),
+    default="full",
+    show_default=True,
+    help="How much progress and results to show: full shows every device and result row, summary shows per-tenant counts and summarised results, whose cost doesn't grow with the number of devices, and quiet shows neither.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Record the latency, errors and response size of every API request, and print a summary by endpoint and tenant at the end.",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also write the recorded API request statistics to this file (implies --profile).",
+)
+@click.option(
+    "--profile-format",
+    type=click.Choice(profile_formats),
+    default="json",
+    show_default=True,
+    help="The format of the --profile-output file.",
+)
 @click.pass_context
-def cli(ctx: any, api_token: str, region: str, tenant_uids: str, all: bool) -> None:
-    tenant_uid_list = tenant_uids.split(",") if tenant_uids else []
+def cli(
+    ctx: any,
+    api_token: str,
+    region: str,
+    tenant_uids: str,
+    all: bool,
+    shard: Tuple[int, int] | None,
+    token_cache: bool,
+    tenant_cache_ttl: int,
+    connection_pool_size: int,
+    rate_limit: float,
+    request_timeout: float,
+    max_retries: int,
+    tenant_failure_threshold: int,
+    display: str,
+    profile: bool,
+    profile_output: str,
+    profile_format: str,
+) -> None:
+    global display_mode
+    display_mode = display
+    ctx.obj["display"] = display
+    if ctx.invoked_subcommand in offline_commands:
+        return
+
+    from services.scc_credentials_service import SccCredentialsService
+    from utils.api_client_pool import (
+        configure_circuit_breaker,
+        configure_connection_pool,
+        configure_profiler,
+        configure_rate_limiter,
+        configure_retry_policy,
+    )
+    from utils.api_profiler import ApiProfiler
+
+    ctx.obj["profiler"] = None
+    if profile or profile_output:
+        profiler = ApiProfiler()
+        configure_profiler(profiler)
+        ctx.obj["profiler"] = profiler
+        ctx.call_on_close(
+            lambda: print_profile_report(
+                profiler,
+                ctx.obj.get("managed_tenants", []),
+                profile_output,
+                profile_format,
+            )
+        )
+
+    # configured before the credentials are validated, so that the validation request
+    # is made with the same limits, timeout and retries as every other request
+    if connection_pool_size:
+        configure_connection_pool(connection_pool_size)
+    configure_rate_limiter(rate_limit)
+    configure_retry_policy(request_timeout or None, max_retries)
+    configure_circuit_breaker(tenant_failure_threshold)
 
     credentials_service = SccCredentialsService(region=region, api_token=api_token)
     credentials_service.load_or_prompt_credentials()
     retrieved_api_token, base_url = credentials_service.get_credentials()
+    ctx.obj["credentials_service"] = credentials_service
     ctx.obj["base_url"] = base_url
     ctx.obj["api_token"] = retrieved_api_token
     ctx.obj["tenant_uids"] = tenant_uids
     ctx.obj["all"] = all
+    ctx.obj["shard"] = shard
+    ctx.obj["tenant_cache_ttl"] = tenant_cache_ttl
+    ctx.obj["connection_pool_size"] = connection_pool_size
+    ctx.obj["token_cache"] = FileCache("tenant-tokens.json") if token_cache else None
+
+
+def parse_shard_option(value: str | None) -> Tuple[int, int] | None:
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def call_with_msp_credentials(ctx: any, call: Callable[[], T]) -> T:
+    """
+    Make the first call of a command to the MSP portal. If the portal rejects the API
+    token, which was validated using a cached result that is now stale, the
+    credentials are asked for again and the call is made once more; call must
+    therefore read the credentials from ctx.obj each time it is called.
+    """
+    from scc_firewall_manager_sdk.exceptions import UnauthorizedException
+
+    try:
+        return call()
+    except UnauthorizedException:
+        credentials_service: SccCredentialsService = ctx.obj["credentials_service"]
+        credentials_service.handle_unauthorized()
+        retrieved_api_token, base_url = credentials_service.get_credentials()
+        ctx.obj["base_url"] = base_url
+        ctx.obj["api_token"] = retrieved_api_token
+        return call()
+
+
+def resolve_managed_tenants(ctx: any) -> List[MspManagedTenant]:
+    """
+    Get the managed tenants selected using the --tenant-uids or --all options, or
+    interactively. Only --all and the interactive picker list every tenant in the
+    portal; tenants passed using --tenant-uids are looked up directly.
+    """
+    managed_tenants = call_with_msp_credentials(ctx, lambda: get_managed_tenants(ctx))
+    if not ctx.obj["tenant_uids"] and not ctx.obj["all"]:
+        managed_tenants = select_tenants_using_cli(managed_tenants)
+    managed_tenants = select_shard_of_managed_tenants(ctx, managed_tenants)
+    ctx.obj["managed_tenants"] = managed_tenants
+    return managed_tenants
+
 
-    with ApiClient(
-        configuration=Configuration(host=base_url, access_token=retrieved_api_token)
-    ) as api_client:
-        msp_tenants_service = MspService(api_client)
+def select_shard_of_managed_tenants(
+    ctx: any, managed_tenants: List[MspManagedTenant]
+) -> List[MspManagedTenant]:
+    """Narrow the selected tenants down to those in the --shard, if one was given."""
+    if not ctx.obj["shard"]:
+        return managed_tenants
+    shard_index, shard_count = ctx.obj["shard"]
+    ctx.obj["unsharded_tenant_uids"] = [tenant.uid for tenant in managed_tenants]
+    shard_tenants = select_shard(managed_tenants, shard_index, shard_count)
+    get_console().print(
+        f"Shard {shard_index}/{shard_count}: {len(shard_tenants)} of {len(managed_tenants)} selected tenants."
+    )
+    return shard_tenants
+
+
+def get_managed_tenants(ctx: any) -> List[MspManagedTenant]:
+    from rich.progress import Progress, SpinnerColumn, TextColumn
+
+    from services.msp_service import MspService
+    from utils.api_client_pool import create_api_client
+
+    with create_api_client(ctx.obj["base_url"], ctx.obj["api_token"]) as api_client:
+        msp_tenants_service = MspService(
+            api_client,
+            tenant_list_cache=FileCache("managed-tenants.json"),
+            tenant_list_cache_ttl_seconds=ctx.obj["tenant_cache_ttl"],
+        )
         with Progress(
             TextColumn("[progress.description]{task.description}"),
             SpinnerColumn(),
             transient=True,
+            # the same console as every other message, which may not be stdout
+            console=get_console(),
         ) as progress:
             get_managed_tenants_task: TaskID = progress.add_task(
                 "Getting managed tenants....", start=True
             )
-            msp_managed_tenants = msp_tenants_service.get_managed_tenants()
+            if ctx.obj["tenant_uids"] and not ctx.obj["all"]:
+                tenant_uids = [
+                    tenant_uid.strip()
+                    for tenant_uid in ctx.obj["tenant_uids"].split(",")
+                    if tenant_uid.strip()
+                ]
+                managed_tenants_by_uid = msp_tenants_service.get_managed_tenants_by_uid(
+                    tenant_uids
+                )
+                for tenant_uid in tenant_uids:
+                    if tenant_uid not in managed_tenants_by_uid:
+                        get_console().print(
+                            f"Tenant {tenant_uid} is not managed by this MSSP portal, skipping.",
+                            style="yellow",
+                        )
+                msp_managed_tenants = list(managed_tenants_by_uid.values())
+            else:
+                msp_managed_tenants = msp_tenants_service.get_managed_tenants()
             progress.stop_task(task_id=get_managed_tenants_task)
+    return msp_managed_tenants
 
-    if all:
-        ctx.obj["managed_tenants"] = msp_managed_tenants
-    elif len(tenant_uid_list) > 0:
-        ctx.obj["managed_tenants"] = [
-            msp_managed_tenant
-            for msp_managed_tenant in msp_managed_tenants
-            if msp_managed_tenant.uid in tenant_uid_list
-        ]
-    else:
-        ctx.obj["managed_tenants"] = msp_managed_tenants
+
+def print_profile_report(
+    profiler: ApiProfiler,
+    managed_tenants: List[MspManagedTenant],
+    profile_output: str | None,
+    profile_format: str,
+    top: int = 10,
+) -> None:
+    from rich.table import Table
+
+    endpoints_table = Table(title="API requests by endpoint")
+    tenants_table = Table(title=f"Slowest {top} tenants")
+    for table, group_column in [
+        (endpoints_table, "Endpoint"),
+        (tenants_table, "Tenant"),
+    ]:
+        table.add_column(group_column, no_wrap=True)
+        for column in [
+            "Calls",
+            "Errors",
+            "Total (s)",
+            "p50 (ms)",
+            "p95 (ms)",
+            "Max (ms)",
+            "KiB",
+        ]:
+            table.add_column(column, justify="right")
+
+    def add_row(table: Table, name: str, stats: EndpointStats):
+        table.add_row(
+            name,
+            str(stats.count),
+            str(stats.errors),
+            f"{stats.total_seconds:.1f}",
+            f"{stats.get_quantile(0.5) * 1000:.0f}",
+            f"{stats.get_quantile(0.95) * 1000:.0f}",
+            f"{stats.max_seconds * 1000:.0f}",
+            f"{stats.response_bytes / 1024:.1f}",
+        )
+
+    for endpoint, stats in sorted(
+        profiler.get_stats_by_endpoint().items(),
+        key=lambda item: item[1].total_seconds,
+        reverse=True,
+    ):
+        add_row(endpoints_table, endpoint, stats)
+    tenant_names = {tenant.uid: tenant.display_name for tenant in managed_tenants}
+    for tenant_uid, stats in sorted(
+        profiler.get_stats_by_tenant().items(),
+        key=lambda item: item[1].total_seconds,
+        reverse=True,
+    )[:top]:
+        add_row(
+            tenants_table,
+            tenant_names.get(tenant_uid, tenant_uid) if tenant_uid else "(MSSP portal)",
+            stats,
+        )
+
+    get_console().print(endpoints_table)
+    get_console().print(tenants_table)
+    if profile_output:
+        profiler.write(profile_output, profile_format)
+        get_console().print(f"API request statistics written to {profile_output}")
 
 
 def get_api_token_for_user_in_tenant(
-    msp_service: MspService, tenant: MspManagedTenant
+    tenant_token_service: TenantTokenService, tenant: MspManagedTenant
 ) -> str | None:
+    from scc_firewall_manager_sdk.exceptions import (
+        ForbiddenException,
+        UnauthorizedException,
+    )
+
     try:
-        return msp_service.get_token_for_api_only_user(
+        return tenant_token_service.get_token(
             tenant_uid=tenant.uid, tenant_name=tenant.name
         )
     except UnauthorizedException as e:
-        console.print(
+        get_console().print(
             f"\nThe token used to connect tenant {tenant.display_name} to the MSSP portal is invalid. Please delete and re-onboard this tenant using the SCC Firewall MSSP portal.",
             style="red",
         )
         return None
     except ForbiddenException as e:
-        console.print(
+        get_console().print(
             f"\nThe token used to connect tenant {tenant.display_name} to the MSSP portal is not a super-admin token. Please delete and re-onboard this tenant using the SCC Firewall MSSP portal.",
             style="red",
         )
 
 
+def call_with_tenant_token(
+    tenant_token_service: TenantTokenService,
+    tenant: MspManagedTenant,
+    call: Callable[[str], T],
+) -> T | None:
+    """
+    Get a token for the tenant and make call with it. If the API rejects the token,
+    which may have been revoked since it was cached, the token is forgotten and call
+    is made once more with a new one. Returns None if there is no token for the tenant.
+    """
+    from scc_firewall_manager_sdk.exceptions import UnauthorizedException
+
+    for attempt in range(2):
+        tenant_api_token = get_api_token_for_user_in_tenant(
+            tenant_token_service, tenant
+        )
+        if tenant_api_token is None:
+            return None
+        try:
+            return call(tenant_api_token)
+        except UnauthorizedException:
+            if attempt > 0:
+                raise
+            tenant_token_service.invalidate(tenant.uid)
+
+
 def select_tenants_using_cli(
     managed_tenants: List[MspManagedTenant],
 ) -> List[MspManagedTenant]:
+    import questionary
+
     # Prepare the choices for the multi-select
     choices = [f"{tenant.display_name} ({tenant.uid})" for tenant in managed_tenants]
 
@@ -141,46 +534,67 @@ def select_tenants_using_cli(
     ).ask()
 
     # Extract the tenant UIDs from the selected options
-    selected_tenants = []
-    for choice in selected_tenant_strs:
-        tenant_uid = choice.split("(")[-1].strip(")")
-        selected_tenants.append(
-            next(
-                (tenant for tenant in managed_tenants if tenant.uid == tenant_uid),
-                None,
-            )
-        )
+    managed_tenants_by_uid = {tenant.uid: tenant for tenant in managed_tenants}
+    return [
+        managed_tenants_by_uid[choice.split("(")[-1].strip(")")]
+        for choice in selected_tenant_strs
+    ]
+
 
-    return selected_tenants
+upgrade_result_columns = [
+    "Tenant UID",
+    "Device UID",
+    "Device Name",
+    "Version",
+    "Status",
+    "Reason",
+]
+suggested_ftd_version_columns = [
+    "Tenant Name",
+    "Tenant UID",
+    "Device Name",
+    "Device UID",
+    "Version",
+    "Upgrade Package UID",
+]
 
 
 def prepare_table() -> Table:
     """Prepare the table for displaying results."""
+    from rich.table import Table
+
     table = Table(title="Suggested FTD versions")
-    table.add_column("Tenant Name", justify="center")
-    table.add_column("Tenant UID", justify="center")
-    table.add_column("Device Name", justify="center")
-    table.add_column("Device UID", justify="center")
-    table.add_column("Version", justify="center")
-    table.add_column("Upgrade Package UID", justify="center")
+    for column in suggested_ftd_version_columns:
+        table.add_column(column, justify="center")
     return table
 
 
-def get_suggested_ftd_version_info_for_device_in_tenant(
-    device: Device, tenant: MspManagedTenant, tenant_api_client: ApiClient
-) -> List[str]:
-    """Get the suggested FTD version information for a device in a tenant."""
-    device_upgrade_service = DeviceUpgradeService(tenant_api_client)
-    get_device_upgrade_versions_task = per_tenant_progress.add_task(
-        f"Getting suggested upgrade version for device {device.name} in {tenant.display_name}...",
-        start=True,
+def get_suggested_ftd_version_for_device_in_tenant(
+    device: Device,
+    tenant: MspManagedTenant,
+    tenant_api_client: ApiClient,
+    compatible_version_cache: CompatibleVersionCache | None = None,
+) -> FtdVersion | None:
+    """Get the suggested FTD version for a device in a tenant."""
+    from services.device_upgrade_service import DeviceUpgradeService
+
+    device_upgrade_service = DeviceUpgradeService(
+        tenant_api_client, compatible_version_cache
     )
-    suggested_version = device_upgrade_service.get_suggested_compatible_version(
-        device_uid=device.uid
+    get_device_upgrade_versions_task = get_progress_display().add_device_task(
+        f"Getting suggested upgrade version for device {device.name} in {tenant.display_name}..."
     )
-    per_tenant_progress.stop_task(task_id=get_device_upgrade_versions_task)
-    per_tenant_progress.remove_task(task_id=get_device_upgrade_versions_task)
+    try:
+        return device_upgrade_service.get_suggested_compatible_version_for_device(
+            device, tenant.uid
+        )
+    finally:
+        get_progress_display().remove_device_task(get_device_upgrade_versions_task)
+
 
+def to_suggested_ftd_version_row(
+    tenant: MspManagedTenant, device: Device, suggested_version: FtdVersion | None
+) -> List[str]:
     if suggested_version:
         return [
             tenant.display_name,
@@ -196,56 +610,198 @@ def get_suggested_ftd_version_info_for_device_in_tenant(
             tenant.uid,
             device.name,
             device.uid,
-            "Not found",
+            not_found_version,
             "N/A",
         ]
 
 
 def get_sugggested_ftd_versions_for_tenant(
-    tenant: MspManagedTenant, base_url: str, tenant_api_token: str
-) -> list[str]:
-    with ApiClient(
-        Configuration(host=base_url, access_token=tenant_api_token)
+    tenant: MspManagedTenant,
+    base_url: str,
+    tenant_api_token: str,
+    device_concurrency: int = 1,
+    compatible_version_cache: CompatibleVersionCache | None = None,
+) -> List[Tuple[Device, FtdVersion | None]]:
+    """
+    Get the FTD devices in a tenant with their suggested versions, one entry per
+    device, in the order returned by the inventory API. The device pages are
+    streamed, but the entries are collected into a list, as a tenant's results are
+    written (or, if its requests fail part-way, skipped) as a whole; memory use
+    therefore grows with the largest tenant, not with the whole run.
+    """
+    from services.inventory_api_service import InventoryApiService
+    from utils.api_client_pool import create_api_client
+
+    with create_api_client(
+        base_url, tenant_api_token, tenant_uid=tenant.uid
     ) as tenant_api_client:
         inventory_api_service = InventoryApiService(tenant_api_client)
-        get_ftd_devices_task = per_tenant_progress.add_task(
+        get_ftd_devices_task = get_progress_display().per_tenant_progress.add_task(
             f"Getting FTD devices in {tenant.display_name}...",
             start=True,
         )
-        devices: List[Device] = inventory_api_service.get_devices(
+        # devices are streamed page by page, so lookups for the first page can start
+        # before the last page has been fetched
+        devices: Iterator[Device] = inventory_api_service.iter_devices(
             q="deviceType:CDFMC_MANAGED_FTD"
         )
-        per_tenant_progress.stop_task(task_id=get_ftd_devices_task)
-        per_tenant_progress.remove_task(task_id=get_ftd_devices_task)
+        try:
+
+            def get_device_with_suggested_version(
+                device: Device,
+            ) -> Tuple[Device, FtdVersion | None]:
+                suggested_version = get_suggested_ftd_version_for_device_in_tenant(
+                    device, tenant, tenant_api_client, compatible_version_cache
+                )
+                get_progress_display().per_tenant_progress.advance(get_ftd_devices_task)
+                return device, suggested_version
 
-        tenant_rows = []
-        for device in devices:
-            tenant_rows.append(
-                get_suggested_ftd_version_info_for_device_in_tenant(
-                    device, tenant, tenant_api_client
+            return list(
+                ordered_map(
+                    get_device_with_suggested_version,
+                    devices,
+                    max_workers=device_concurrency,
+                    max_in_flight=device_concurrency * 2,
                 )
             )
+        finally:
+            get_progress_display().per_tenant_progress.stop_task(
+                task_id=get_ftd_devices_task
+            )
+            get_progress_display().per_tenant_progress.remove_task(
+                task_id=get_ftd_devices_task
+            )
 
-        return tenant_rows
 
+def get_devices_with_suggested_ftd_versions_for_managed_tenant(
+    tenant_token_service: TenantTokenService,
+    tenant: MspManagedTenant,
+    base_url: str,
+    device_concurrency: int = 1,
+    compatible_version_cache: CompatibleVersionCache | None = None,
+) -> List[Tuple[Device, FtdVersion | None]] | None:
+    """
+    Get a token for the tenant and retrieve its FTD devices with their suggested
+    versions. Returns None if the tenant had to be skipped, including when its
+    requests kept failing, so that one broken tenant doesn't fail the whole run.
+    """
+    from utils.retry_policy import request_errors
 
-def write_output_to_csv(output_file: str, csv_rows: list) -> None:
-    with open(output_file, mode="w", newline="", encoding="utf-8") as csv_file:
-        writer = csv.writer(csv_file)
-        # Write header
-        writer.writerow(
-            [
-                "Tenant Name",
-                "Tenant UID",
-                "Device Name",
-                "Device UID",
-                "Version",
-                "Upgrade Package UID",
-            ]
+    try:
+        return call_with_tenant_token(
+            tenant_token_service,
+            tenant,
+            lambda tenant_api_token: get_sugggested_ftd_versions_for_tenant(
+                tenant,
+                base_url,
+                tenant_api_token,
+                device_concurrency,
+                compatible_version_cache,
+            ),
+        )
+    except request_errors as e:
+        get_console().print(
+            f"\nSkipping tenant {tenant.display_name} ({tenant.uid}): {describe_error(e)}",
+            style="red",
         )
-        # Write rows
-        writer.writerows(csv_rows)
-    console.print(f"Results written to {output_file}", style="green")
+        return None
+
+
+def get_suggested_ftd_versions_for_managed_tenant(
+    tenant_token_service: TenantTokenService,
+    tenant: MspManagedTenant,
+    base_url: str,
+    tenants_task: TaskID,
+    device_concurrency: int = 1,
+    checkpoint_journal: CheckpointJournal | None = None,
+    compatible_version_cache: CompatibleVersionCache | None = None,
+) -> List[List[str]] | None:
+    """
+    Get a token for the tenant and retrieve the suggested FTD versions for its devices.
+    Returns None if the tenant had to be skipped.
+    """
+    get_progress_display().overall_progress.update(
+        task_id=tenants_task, tenant_name=tenant.display_name
+    )
+    try:
+        if checkpoint_journal and checkpoint_journal.is_completed(tenant.uid):
+            return checkpoint_journal.get_rows(tenant.uid)
+
+        devices_with_suggested_versions = (
+            get_devices_with_suggested_ftd_versions_for_managed_tenant(
+                tenant_token_service,
+                tenant,
+                base_url,
+                device_concurrency,
+                compatible_version_cache,
+            )
+        )
+        if devices_with_suggested_versions is None:
+            return None
+        tenant_rows = [
+            to_suggested_ftd_version_row(tenant, device, suggested_version)
+            for device, suggested_version in devices_with_suggested_versions
+        ]
+        if checkpoint_journal:
+            checkpoint_journal.record(tenant.uid, tenant_rows)
+        return tenant_rows
+    finally:
+        get_progress_display().overall_progress.update(tenants_task, advance=1)
+
+
+def describe_error(error: Exception) -> str:
+    from scc_firewall_manager_sdk.exceptions import ApiException
+    from urllib3.exceptions import MaxRetryError, TimeoutError
+
+    if isinstance(error, ApiException):
+        return f"{error.status} {error.reason}"
+    if isinstance(error, MaxRetryError) and error.reason is not None:
+        error = error.reason
+    if isinstance(error, TimeoutError):
+        return f"Request timed out: {error}"
+    return str(error)
+
+
+def add_tenant_to_msp_portal(
+    msp_service: MspService, tenant_uid: str, tenants_task: TaskID
+) -> List[str]:
+    """
+    Add a tenant to the MSP portal, returning a row describing the outcome. A rejected
+    API token is raised instead, as it would fail every tenant alike.
+    """
+    from scc_firewall_manager_sdk.exceptions import UnauthorizedException
+
+    from utils.retry_policy import request_errors
+
+    get_progress_display().overall_progress.update(
+        task_id=tenants_task, tenant_name=tenant_uid
+    )
+    try:
+        transaction_uid = msp_service.submit_add_tenant(tenant_uid)
+        if transaction_uid is None:
+            result_row = [tenant_uid, "already present", ""]
+        else:
+            msp_service.transaction_service.wait_for_transaction_to_finish(
+                transaction_uid
+            )
+            # so that the next command doesn't miss the tenant in a tenant list snapshot
+            msp_service.forget_managed_tenants()
+            result_row = [tenant_uid, "added", ""]
+    except UnauthorizedException:
+        raise
+    except (*request_errors, RuntimeError) as e:
+        result_row = [tenant_uid, "failed", describe_error(e)]
+    get_progress_display().overall_progress.update(tenants_task, advance=1)
+    return result_row
+
+
+def read_failed_tenant_uids(results_file: str) -> List[str]:
+    with open(results_file, "r", newline="", encoding="utf-8") as csv_file:
+        return [
+            row["Tenant UID"]
+            for row in csv.DictReader(csv_file)
+            if row["Status"] == "failed"
+        ]
 
 
 @click.command(name="add-tenants")
@@ -254,78 +810,1596 @@ def write_output_to_csv(output_file: str, csv_rows: list) -> None:
     type=click.Path(exists=True, dir_okay=False, readable=True, resolve_path=True),
     help="Path to a file containing tenant UIDs, one per line.",
 )
+@click.option(
+    "--retry-failed",
+    type=click.Path(exists=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Path to a results file from a previous run. Only the tenants that failed in that run are added.",
+)
+@click.option(
+    "--in-flight",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of tenants to add at the same time.",
+)
+@click.option(
+    "--results-file",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="Path to a CSV file to record whether each tenant was added, already present, or failed.",
+)
 @click.pass_context
-def add_tenants_to_msp(ctx: any, tenant_uids: str) -> None:
+def add_tenants_to_msp(
+    ctx: any, tenant_uids: str, retry_failed: str, in_flight: int, results_file: str
+) -> None:
+    from services.msp_service import MspService
+    from utils.api_client_pool import configure_connection_pool, create_api_client
+
+    if tenant_uids and retry_failed:
+        raise click.UsageError("Use either --tenant-uids or --retry-failed, not both.")
+    if not ctx.obj["connection_pool_size"]:
+        configure_connection_pool(in_flight)
     if tenant_uids:
         with open(tenant_uids, "r", encoding="utf-8") as file:
             tenant_uid_list = [line.strip() for line in file if line.strip()]
         ctx.obj["tenant_uids"] = tenant_uid_list
+    elif retry_failed:
+        ctx.obj["tenant_uids"] = read_failed_tenant_uids(retry_failed)
     else:
         ctx.obj["tenant_uids"] = []
 
-    with live:
-        tenants_task = overall_progress.add_task(
-            "Adding tenants...", total=len(tenant_uids), tenant_name="TBD"
-        )
-        with ApiClient(
-            Configuration(host=ctx.obj["base_url"], access_token=ctx.obj["api_token"])
-        ) as api_client:
-            msp_service = MspService(api_client)
-            for tenant_uid in ctx.obj["tenant_uids"]:
-                overall_progress.update(task_id=tenants_task, tenant_name=tenant_uid)
-                msp_service.add_tenant(tenant_uid)
-                overall_progress.update(tenants_task, advance=1)
+    results_csv_file = (
+        open(results_file, mode="w", newline="", encoding="utf-8")
+        if results_file
+        else None
+    )
+    try:
+        results_writer = csv.writer(results_csv_file) if results_csv_file else None
+        if results_writer:
+            results_writer.writerow(["Tenant UID", "Status", "Reason"])
+        with get_progress_display().live:
+            tenants_task = get_progress_display().overall_progress.add_task(
+                "Adding tenants...",
+                total=len(ctx.obj["tenant_uids"]),
+                tenant_name="TBD",
+            )
+
+            def add_tenants(tenant_uids: List[str]) -> Iterator[List[str]]:
+                with create_api_client(
+                    ctx.obj["base_url"], ctx.obj["api_token"]
+                ) as api_client:
+                    msp_service = MspService(
+                        api_client, tenant_list_cache=FileCache("managed-tenants.json")
+                    )
+                    # with more than one tenant in flight, new adds are submitted
+                    # while the transactions of earlier ones are still being polled
+                    yield from ordered_map(
+                        lambda tenant_uid: add_tenant_to_msp_portal(
+                            msp_service, tenant_uid, tenants_task
+                        ),
+                        tenant_uids,
+                        max_workers=in_flight,
+                    )
+
+            # the first tenant is added on its own, so that a rejected API token is
+            # handled before the rest are submitted
+            first_result_rows = call_with_msp_credentials(
+                ctx, lambda: list(add_tenants(ctx.obj["tenant_uids"][:1]))
+            )
+            for result_row in itertools.chain(
+                first_result_rows, add_tenants(ctx.obj["tenant_uids"][1:])
+            ):
+                if result_row[1] == "failed":
+                    get_console().print(
+                        f"\nFailed to add tenant {result_row[0]}: {result_row[2]}",
+                        style="red",
+                    )
+                if results_writer:
+                    results_writer.writerow(result_row)
+                    results_csv_file.flush()
+    finally:
+        if results_csv_file:
+            results_csv_file.close()
+    if results_file:
+        get_console().print(f"Results written to {results_file}", style="green")
 
 
 @click.command(name="get-suggested-ftd-versions")
 @click.option(
     "--output-file",
     type=click.Path(dir_okay=False, writable=True, resolve_path=True),
-    help="Path to the output CSV file.",
+    help="Path to the output file. Rows are written as soon as each tenant has been processed.",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(output_formats),
+    default="csv",
+    show_default=True,
+    help="The format of the output file. Parquet output requires pyarrow to be installed.",
+)
+@click.option(
+    "--tenant-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of tenants to process concurrently.",
+)
+@click.option(
+    "--device-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of devices in each tenant to look up suggested versions for concurrently.",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="Path to a journal file to record each tenant in as soon as it has been processed.",
+)
+@click.option(
+    "--resume",
+    type=click.Path(exists=True, dir_okay=False, writable=True, resolve_path=True),
+    help="Path to the journal file of an interrupted run. Tenants already recorded in it are not processed again, and newly processed tenants are appended to it.",
+)
+@click.option(
+    "--exact-version-lookups",
+    is_flag=True,
+    help="Look up the suggested version of every device individually, instead of once per tenant for devices of the same model and software version.",
+)
+@click.option(
+    "--version-cache-ttl",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Remember suggested versions in ~/.cisco-security-cache for this many seconds, across runs (0 disables the on-disk cache).",
+)
+@click.option(
+    "--top",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="With --display summary, the number of tenants to show, those with the most devices first.",
 )
 @click.pass_context
-def get_suggested_ftd_versions(ctx: any, output_file: str) -> None:
-    table: Table = prepare_table()
-    csv_rows = []  # To store rows for CSV output
+def get_suggested_ftd_versions(
+    ctx: any,
+    output_file: str,
+    output_format: str,
+    tenant_concurrency: int,
+    device_concurrency: int,
+    checkpoint: str,
+    resume: str,
+    exact_version_lookups: bool,
+    version_cache_ttl: int,
+    top: int,
+) -> None:
     """Retrieve the list of suggested versions for the selected tenants."""
-    if not ctx.obj["tenant_uids"] and not ctx.obj["all"]:
-        selected_tenants = select_tenants_using_cli(ctx.obj["managed_tenants"])
-    else:
-        selected_tenants = ctx.obj["managed_tenants"]
-    console.print(
+    from services.compatible_version_cache import CompatibleVersionCache
+    from services.inventory_api_service import default_page_concurrency
+    from services.msp_service import MspService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_client_pool import configure_connection_pool, create_api_client
+
+    if checkpoint and resume:
+        raise click.UsageError("Use either --checkpoint or --resume, not both.")
+    if not ctx.obj["connection_pool_size"]:
+        # each tenant worker makes its own requests, plus those of its device (or
+        # device page) workers
+        configure_connection_pool(
+            tenant_concurrency * (1 + max(device_concurrency, default_page_concurrency))
+        )
+    # only full mode keeps every row to show at the end
+    table: Table | None = prepare_table() if ctx.obj["display"] == "full" else None
+    summary = SuggestedVersionSummary()
+    selected_tenants = resolve_managed_tenants(ctx)
+    get_console().print(
         f"Getting suggested FTD version for {len(selected_tenants)} managed tenants. This may take a while..."
     )
 
-    with live:
-        tenants_task = overall_progress.add_task(
+    try:
+        output_writer = (
+            create_output_writer(
+                output_format, output_file, suggested_ftd_version_columns
+            )
+            if output_file
+            else None
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    checkpoint_journal = (
+        CheckpointJournal(checkpoint or resume, resume=bool(resume))
+        if checkpoint or resume
+        else None
+    )
+    compatible_version_cache = (
+        CompatibleVersionCache(
+            # looked-up versions are kept in memory during the run, and written
+            # to the file once at the end
+            FileCache("compatible-versions.json", max_entries=10000, flush_every=None),
+            version_cache_ttl,
+        )
+        if not exact_version_lookups
+        else None
+    )
+    if checkpoint_journal and resume:
+        get_console().print(
+            f"Resuming: {len(checkpoint_journal.completed_tenants)} tenants were already processed."
+        )
+
+    completed_tenant_uids = []
+    with get_progress_display().live:
+        tenants_task = get_progress_display().overall_progress.add_task(
             "Processing tenants...", total=len(selected_tenants), tenant_name="TBD"
         )
-        with ApiClient(
-            Configuration(host=ctx.obj["base_url"], access_token=ctx.obj["api_token"])
-        ) as api_client:
+        try:
+            with create_api_client(
+                ctx.obj["base_url"], ctx.obj["api_token"]
+            ) as api_client:
+                tenant_token_service = TenantTokenService(
+                    MspService(api_client),
+                    ctx.obj["api_token"],
+                    ctx.obj["token_cache"],
+                )
+                # results are yielded in the order of selected_tenants, so the output
+                # is stable no matter which tenant finishes first
+                for tenant, tenant_rows in zip(
+                    selected_tenants,
+                    ordered_map(
+                        lambda tenant: get_suggested_ftd_versions_for_managed_tenant(
+                            tenant_token_service,
+                            tenant,
+                            ctx.obj["base_url"],
+                            tenants_task,
+                            device_concurrency,
+                            checkpoint_journal,
+                            compatible_version_cache,
+                        ),
+                        selected_tenants,
+                        max_workers=tenant_concurrency,
+                    ),
+                ):
+                    if tenant_rows is None:
+                        continue
+                    completed_tenant_uids.append(tenant.uid)
+                    summary.add_tenant_rows(
+                        tenant.display_name, tenant.uid, tenant_rows
+                    )
+                    if table:
+                        for tenant_row in tenant_rows:
+                            table.add_row(*tenant_row)
+                    if output_writer:
+                        output_writer.write_rows(tenant_rows)
+        finally:
+            if output_writer:
+                output_writer.close()
+            if checkpoint_journal:
+                checkpoint_journal.close()
+            if compatible_version_cache:
+                compatible_version_cache.flush()
+            if output_file and ctx.obj["shard"]:
+                # written even if the run failed part-way, so that merge can report
+                # exactly which tenants are missing
+                ShardManifest(
+                    *ctx.obj["shard"],
+                    selected_tenant_uids=ctx.obj["unsharded_tenant_uids"],
+                    completed_tenant_uids=completed_tenant_uids,
+                ).write(get_manifest_path(output_file))
+
+    if table:
+        get_console().print(table)
+    elif ctx.obj["display"] == "summary":
+        print_suggested_version_summary(summary, top)
+    get_console().print(
+        f"Found {summary.device_count} devices in {len(summary.tenants)} tenants."
+    )
+    if len(completed_tenant_uids) < len(selected_tenants):
+        get_console().print(
+            f"{len(selected_tenants) - len(completed_tenant_uids)} of {len(selected_tenants)} tenants were skipped.",
+            style="red",
+        )
+    if output_file:
+        get_console().print(f"Results written to {output_file}", style="green")
+
+
+def print_suggested_version_summary(summary: SuggestedVersionSummary, top: int) -> None:
+    from rich.table import Table
+
+    versions_table = Table(title="Devices by suggested version")
+    for column in ["Suggested Version", "Devices", "Tenants"]:
+        versions_table.add_column(column, justify="right")
+    for version, version_summary in summary.get_versions():
+        versions_table.add_row(
+            version, str(version_summary.devices), str(version_summary.tenants)
+        )
+    tenants_table = Table(
+        title=f"Top {min(top, len(summary.tenants))} of {len(summary.tenants)} tenants by devices"
+    )
+    tenants_table.add_column("Tenant")
+    for column in ["Devices", "With Suggested Version", "Without"]:
+        tenants_table.add_column(column, justify="right")
+    for tenant_summary in summary.get_top_tenants(top):
+        tenants_table.add_row(
+            tenant_summary.tenant_name,
+            str(tenant_summary.devices),
+            str(tenant_summary.devices_with_suggested_version),
+            str(tenant_summary.devices - tenant_summary.devices_with_suggested_version),
+        )
+    get_console().print(versions_table)
+    get_console().print(tenants_table)
+
+
+def refresh_managed_tenant(
+    tenant_token_service: TenantTokenService,
+    tenant: MspManagedTenant,
+    base_url: str,
+    tenants_task: TaskID,
+    device_concurrency: int,
+    compatible_version_cache: CompatibleVersionCache,
+) -> List[Tuple[Device, FtdVersion | None]] | None:
+    get_progress_display().overall_progress.update(
+        task_id=tenants_task, tenant_name=tenant.display_name
+    )
+    try:
+        return get_devices_with_suggested_ftd_versions_for_managed_tenant(
+            tenant_token_service,
+            tenant,
+            base_url,
+            device_concurrency,
+            compatible_version_cache,
+        )
+    finally:
+        get_progress_display().overall_progress.update(tenants_task, advance=1)
+
+
+def refresh_tenants_in_inventory(
+    inventory_store: InventoryStore,
+    tenants: List[MspManagedTenant],
+    tenant_token_service: TenantTokenService,
+    base_url: str,
+    tenants_task: TaskID,
+    tenant_concurrency: int,
+    device_concurrency: int,
+) -> int:
+    """Refresh the devices of the given tenants in the inventory, returning how many were refreshed."""
+    from services.compatible_version_cache import CompatibleVersionCache
+
+    # suggested versions are only shared between identical devices within one refresh
+    compatible_version_cache = CompatibleVersionCache()
+    refreshed_tenant_count = 0
+    for tenant, devices_with_suggested_versions in zip(
+        tenants,
+        ordered_map(
+            lambda tenant: refresh_managed_tenant(
+                tenant_token_service,
+                tenant,
+                base_url,
+                tenants_task,
+                device_concurrency,
+                compatible_version_cache,
+            ),
+            tenants,
+            max_workers=tenant_concurrency,
+        ),
+    ):
+        if devices_with_suggested_versions is None:
+            continue
+        inventory_store.replace_tenant_devices(
+            tenant.uid, devices_with_suggested_versions
+        )
+        refreshed_tenant_count += 1
+    return refreshed_tenant_count
+
+
+@click.command(name="refresh")
+@click.option(
+    "--inventory-db",
+    type=click.Path(dir_okay=False),
+    default=default_inventory_db_path,
+    show_default=True,
+    help="Path to the local inventory database.",
+)
+@click.option(
+    "--stale-after",
+    type=click.IntRange(min=0),
+    help="Only refresh tenants whose devices were last refreshed more than this many seconds ago. By default, every selected tenant is refreshed.",
+)
+@click.option(
+    "--tenant-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of tenants to refresh concurrently.",
+)
+@click.option(
+    "--device-concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of devices in each tenant to look up suggested versions for concurrently.",
+)
+@click.pass_context
+def refresh_inventory(
+    ctx: any,
+    inventory_db: str,
+    stale_after: int | None,
+    tenant_concurrency: int,
+    device_concurrency: int,
+) -> None:
+    """Refresh the local inventory of FTD devices and their suggested versions."""
+    from services.inventory_api_service import default_page_concurrency
+    from services.msp_service import MspService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_client_pool import configure_connection_pool, create_api_client
+
+    if not ctx.obj["connection_pool_size"]:
+        configure_connection_pool(
+            tenant_concurrency * (1 + max(device_concurrency, default_page_concurrency))
+        )
+    selected_tenants = resolve_managed_tenants(ctx)
+    inventory_store = InventoryStore(inventory_db)
+    try:
+        inventory_store.upsert_tenants(selected_tenants)
+        if stale_after is not None:
+            stale_tenant_uids = set(
+                inventory_store.get_stale_tenant_uids(
+                    [tenant.uid for tenant in selected_tenants], stale_after
+                )
+            )
+            get_console().print(
+                f"{len(selected_tenants) - len(stale_tenant_uids)} tenants were refreshed less than {stale_after} seconds ago."
+            )
+            selected_tenants = [
+                tenant for tenant in selected_tenants if tenant.uid in stale_tenant_uids
+            ]
+        get_console().print(f"Refreshing {len(selected_tenants)} managed tenants...")
+
+        with get_progress_display().live:
+            tenants_task = get_progress_display().overall_progress.add_task(
+                "Refreshing tenants...", total=len(selected_tenants), tenant_name="TBD"
+            )
+            with create_api_client(
+                ctx.obj["base_url"], ctx.obj["api_token"]
+            ) as api_client:
+                tenant_token_service = TenantTokenService(
+                    MspService(api_client),
+                    ctx.obj["api_token"],
+                    ctx.obj["token_cache"],
+                )
+                refreshed_tenant_count = refresh_tenants_in_inventory(
+                    inventory_store,
+                    selected_tenants,
+                    tenant_token_service,
+                    ctx.obj["base_url"],
+                    tenants_task,
+                    tenant_concurrency,
+                    device_concurrency,
+                )
+    finally:
+        inventory_store.close()
+    get_console().print(
+        f"Refreshed {refreshed_tenant_count} tenants in {inventory_db}", style="green"
+    )
+
+
+def print_query_results(
+    title: str,
+    columns: List[str],
+    rows: List[List[str]],
+    output_file: str | None,
+    output_format: str,
+) -> None:
+    from rich.table import Table
+
+    if output_file:
+        try:
+            output_writer = create_output_writer(output_format, output_file, columns)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        with output_writer:
+            output_writer.write_rows(rows)
+        get_console().print(
+            f"{len(rows)} results written to {output_file}", style="green"
+        )
+        return
+    table = Table(title=f"{title} ({len(rows)})")
+    for column in columns:
+        table.add_column(column)
+    for row in rows:
+        table.add_row(*row)
+    get_console().print(table)
+
+
+def open_inventory_store_for_query(inventory_db: str) -> InventoryStore:
+    if not os.path.exists(os.path.expanduser(inventory_db)):
+        raise click.UsageError(
+            f"There is no inventory at {inventory_db}. Run the refresh command to create it."
+        )
+    return InventoryStore(inventory_db)
+
+
+def inventory_query_options(command):
+    command = click.option(
+        "--output-format",
+        type=click.Choice(output_formats),
+        default="csv",
+        show_default=True,
+        help="The format of the output file.",
+    )(command)
+    command = click.option(
+        "--output-file",
+        type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+        help="Write the results to this file instead of printing them.",
+    )(command)
+    return click.option(
+        "--inventory-db",
+        type=click.Path(dir_okay=False),
+        default=default_inventory_db_path,
+        show_default=True,
+        help="Path to the local inventory database, as written by the refresh command.",
+    )(command)
+
+
+@click.group(name="query")
+def query_inventory() -> None:
+    """
+    Answer questions about the fleet from the local inventory, without calling the
+    API. Run the refresh command to populate the inventory.
+    """
+
+
+@query_inventory.command(name="devices")
+@click.option("--software-version", help="Only devices running this version.")
+@click.option("--model", help="Only devices of this model.")
+@click.option("--tenant-uid", help="Only devices in this tenant.")
+@click.option("--suggested-version", help="Only devices with this suggested version.")
+@click.option(
+    "--without-suggested-version",
+    is_flag=True,
+    help="Only devices that have no suggested version.",
+)
+@inventory_query_options
+def query_devices(
+    software_version: str | None,
+    model: str | None,
+    tenant_uid: str | None,
+    suggested_version: str | None,
+    without_suggested_version: bool,
+    inventory_db: str,
+    output_file: str | None,
+    output_format: str,
+) -> None:
+    """List the devices in the local inventory, e.g. those still on a version."""
+    inventory_store = open_inventory_store_for_query(inventory_db)
+    try:
+        rows = [
+            to_text_row(row)
+            for row in inventory_store.query_devices(
+                software_version=software_version,
+                model=model,
+                tenant_uid=tenant_uid,
+                suggested_version=suggested_version,
+                without_suggested_version=without_suggested_version,
+            )
+        ]
+    finally:
+        inventory_store.close()
+    print_query_results("Devices", device_columns, rows, output_file, output_format)
+
+
+@query_inventory.command(name="tenants")
+@click.option(
+    "--without-suggested-upgrade",
+    is_flag=True,
+    help="Only tenants in which no device has a suggested version.",
+)
+@inventory_query_options
+def query_tenants(
+    without_suggested_upgrade: bool,
+    inventory_db: str,
+    output_file: str | None,
+    output_format: str,
+) -> None:
+    """List the tenants in the local inventory, with how many devices they have."""
+    inventory_store = open_inventory_store_for_query(inventory_db)
+    try:
+        rows = [
+            to_text_row(row)
+            for row in inventory_store.query_tenants(
+                without_suggested_upgrade=without_suggested_upgrade
+            )
+        ]
+    finally:
+        inventory_store.close()
+    print_query_results("Tenants", tenant_columns, rows, output_file, output_format)
+
+
+@click.command(name="serve")
+@click.option(
+    "--inventory-db",
+    type=click.Path(dir_okay=False),
+    default=default_inventory_db_path,
+    show_default=True,
+    help="Path to the local inventory database to keep up to date and serve.",
+)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(min=1), default=8080, show_default=True)
+@click.option(
+    "--cycle-interval",
+    type=click.IntRange(min=1),
+    default=900,
+    show_default=True,
+    help="The number of seconds between the starts of refresh cycles.",
+)
+@click.option(
+    "--tenants-per-cycle",
+    type=click.IntRange(min=1),
+    help="The number of tenants to refresh per cycle, starting with those refreshed longest ago. By default, every tenant is refreshed in each cycle.",
+)
+@click.option(
+    "--tenant-concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="The number of tenants to refresh concurrently.",
+)
+@click.option(
+    "--device-concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="The number of devices in each tenant to look up suggested versions for concurrently.",
+)
+@click.pass_context
+def serve_inventory(
+    ctx: any,
+    inventory_db: str,
+    host: str,
+    port: int,
+    cycle_interval: int,
+    tenants_per_cycle: int | None,
+    tenant_concurrency: int,
+    device_concurrency: int,
+) -> None:
+    """
+    Keep the local inventory of suggested versions up to date, refreshing tenants in
+    rotation, and serve it over HTTP. Requests to the server are answered from the
+    inventory only, and never cause requests to the API.
+    """
+    from services.inventory_api_service import default_page_concurrency
+    from utils.api_client_pool import configure_connection_pool, configure_profiler
+    from utils.api_profiler import ApiProfiler
+    from utils.inventory_server import InventoryServer, RefreshStatus
+
+    if not ctx.obj["tenant_uids"] and not ctx.obj["all"]:
+        raise click.UsageError(
+            "Use --all or --tenant-uids to select the tenants to serve."
+        )
+    if not ctx.obj["connection_pool_size"]:
+        configure_connection_pool(
+            tenant_concurrency * (1 + max(device_concurrency, default_page_concurrency))
+        )
+    profiler = ctx.obj["profiler"]
+    if profiler is None:
+        # API request metrics are served on /metrics
+        profiler = ApiProfiler()
+        configure_profiler(profiler)
+
+    inventory_server = InventoryServer(
+        inventory_db, RefreshStatus(started_at=time.time()), profiler, host, port
+    )
+    inventory_server.start()
+    get_console().print(f"Serving the inventory on http://{host}:{port}")
+    stopped = threading.Event()
+    # on SIGTERM, as sent by service managers, finish the current cycle and stop
+    # cleanly, so that the server is shut down and the caches are written
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    try:
+        while not stopped.is_set():
+            cycle_started_at = time.time()
+            inventory_server.update_refresh_status(
+                last_cycle_started_at=cycle_started_at
+            )
+            refreshed_tenant_count, error = 0, None
+            try:
+                refreshed_tenant_count = run_serve_cycle(
+                    ctx,
+                    inventory_db,
+                    tenants_per_cycle,
+                    tenant_concurrency,
+                    device_concurrency,
+                )
+            except Exception as e:
+                error = describe_error(e)
+                get_console().print(f"Refresh cycle failed: {error}", style="red")
+            cycle_seconds = time.time() - cycle_started_at
+            inventory_server.update_refresh_status(
+                cycles=inventory_server.refresh_status.cycles + 1,
+                last_cycle_finished_at=time.time(),
+                last_cycle_seconds=round(cycle_seconds, 3),
+                last_cycle_refreshed_tenants=refreshed_tenant_count,
+                last_cycle_error=error,
+            )
+            get_console().print(
+                f"Refreshed {refreshed_tenant_count} tenants in {cycle_seconds:.1f}s"
+            )
+            stopped.wait(max(0.0, cycle_interval - cycle_seconds))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inventory_server.shutdown()
+
+
+def run_serve_cycle(
+    ctx: any,
+    inventory_db: str,
+    tenants_per_cycle: int | None,
+    tenant_concurrency: int,
+    device_concurrency: int,
+) -> int:
+    from services.msp_service import MspService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_client_pool import create_api_client
+
+    # the tenant list is resolved every cycle, to pick up tenants added to the portal;
+    # use --tenant-cache-ttl to do so less often
+    managed_tenants = select_shard_of_managed_tenants(
+        ctx, call_with_msp_credentials(ctx, lambda: get_managed_tenants(ctx))
+    )
+    ctx.obj["managed_tenants"] = managed_tenants
+    managed_tenants_by_uid = {tenant.uid: tenant for tenant in managed_tenants}
+    with InventoryStore(inventory_db) as inventory_store:
+        inventory_store.upsert_tenants(managed_tenants)
+        tenant_uids = inventory_store.order_by_staleness(managed_tenants_by_uid)
+        tenants = [
+            managed_tenants_by_uid[tenant_uid]
+            for tenant_uid in tenant_uids[:tenants_per_cycle]
+        ]
+        overall_progress = get_progress_display().overall_progress
+        tenants_task = overall_progress.add_task(
+            "Refreshing tenants...", total=len(tenants), tenant_name="TBD"
+        )
+        # the client is cheap to create, as it shares the pooled connections, and
+        # the tenant tokens are reused from the token cache between cycles
+        try:
+            with create_api_client(
+                ctx.obj["base_url"], ctx.obj["api_token"]
+            ) as api_client:
+                tenant_token_service = TenantTokenService(
+                    MspService(api_client),
+                    ctx.obj["api_token"],
+                    ctx.obj["token_cache"],
+                )
+                return refresh_tenants_in_inventory(
+                    inventory_store,
+                    tenants,
+                    tenant_token_service,
+                    ctx.obj["base_url"],
+                    tenants_task,
+                    tenant_concurrency,
+                    device_concurrency,
+                )
+        finally:
+            overall_progress.remove_task(tenants_task)
+            # serve is usually stopped with a signal, which skips flushing at exit
+            if ctx.obj["token_cache"] is not None:
+                ctx.obj["token_cache"].flush()
+
+
+def get_suggested_ftd_version_rows(
+    ctx: any, tenant_concurrency: int, device_concurrency: int
+) -> List[List[str]]:
+    """Look up the suggested versions of the devices in the selected tenants."""
+    from services.compatible_version_cache import CompatibleVersionCache
+    from services.msp_service import MspService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_client_pool import create_api_client
+
+    selected_tenants = resolve_managed_tenants(ctx)
+    compatible_version_cache = CompatibleVersionCache()
+    rows = []
+    with get_progress_display().live:
+        tenants_task = get_progress_display().overall_progress.add_task(
+            "Getting suggested versions...",
+            total=len(selected_tenants),
+            tenant_name="TBD",
+        )
+        with create_api_client(ctx.obj["base_url"], ctx.obj["api_token"]) as api_client:
+            tenant_token_service = TenantTokenService(
+                MspService(api_client), ctx.obj["api_token"], ctx.obj["token_cache"]
+            )
+            for tenant_rows in ordered_map(
+                lambda tenant: get_suggested_ftd_versions_for_managed_tenant(
+                    tenant_token_service,
+                    tenant,
+                    ctx.obj["base_url"],
+                    tenants_task,
+                    device_concurrency,
+                    compatible_version_cache=compatible_version_cache,
+                ),
+                selected_tenants,
+                max_workers=tenant_concurrency,
+            ):
+                rows.extend(tenant_rows or [])
+    return rows
+
+
+def to_upgrade_result_row(
+    upgrade: DeviceUpgrade, status: str, reason: str = ""
+) -> List[str]:
+    return [
+        upgrade.tenant_uid,
+        upgrade.device_uid,
+        upgrade.device_name,
+        upgrade.version,
+        status,
+        reason,
+    ]
+
+
+def upgrade_devices_in_tenant(
+    tenant_token_service: TenantTokenService,
+    tenant: MspManagedTenant,
+    base_url: str,
+    upgrades: List[DeviceUpgrade],
+    upgrades_task: TaskID,
+) -> List[List[str]]:
+    """
+    Upgrade devices in a tenant, waiting for all of their transactions together, and
+    return a row describing the outcome for each device.
+    """
+    from scc_firewall_manager_sdk.exceptions import UnauthorizedException
+
+    from services.device_upgrade_service import DeviceUpgradeService
+    from utils.api_client_pool import create_api_client
+    from utils.retry_policy import request_errors
+
+    upgrades_by_device_uid = {upgrade.device_uid: upgrade for upgrade in upgrades}
+
+    def to_result_row(device_uid: str, status: str, reason: str = "") -> List[str]:
+        get_progress_display().overall_progress.update(upgrades_task, advance=1)
+        return to_upgrade_result_row(upgrades_by_device_uid[device_uid], status, reason)
+
+    def upgrade_devices(tenant_api_token: str) -> List[Tuple[str, Exception | None]]:
+        with create_api_client(
+            base_url, tenant_api_token, tenant_uid=tenant.uid
+        ) as tenant_api_client:
+            return list(
+                DeviceUpgradeService(tenant_api_client).upgrade_devices(
+                    {
+                        upgrade.device_uid: upgrade.upgrade_package_uid
+                        for upgrade in upgrades
+                    },
+                    max_concurrency=len(upgrades),
+                )
+            )
+
+    try:
+        results = call_with_tenant_token(tenant_token_service, tenant, upgrade_devices)
+    except request_errors as e:
+        results, token_error = None, describe_error(e)
+    else:
+        token_error = "No API token for the tenant"
+    if results is None:
+        return [
+            to_result_row(device_uid, "failed", token_error)
+            for device_uid in upgrades_by_device_uid
+        ]
+    if any(isinstance(error, UnauthorizedException) for _, error in results):
+        # the token was rejected part-way, so don't reuse it in the next wave or run
+        tenant_token_service.invalidate(tenant.uid)
+    return [
+        (
+            to_result_row(device_uid, "upgraded")
+            if error is None
+            else to_result_row(device_uid, "failed", describe_error(error))
+        )
+        for device_uid, error in results
+    ]
+
+
+def print_upgrade_plan(waves: List[List[DeviceUpgrade]]) -> None:
+    from rich.table import Table
+
+    table = Table(title="Upgrade waves")
+    for column in ["Wave", "Devices", "Tenants", "Versions"]:
+        table.add_column(column, justify="right" if column != "Versions" else "left")
+    for wave_number, wave in enumerate(waves, start=1):
+        table.add_row(
+            str(wave_number),
+            str(len(wave)),
+            str(len({upgrade.tenant_uid for upgrade in wave})),
+            ", ".join(sorted({upgrade.version for upgrade in wave})),
+        )
+    get_console().print(table)
+
+
+@click.command(name="upgrade-devices")
+@click.option(
+    "--input-file",
+    type=click.Path(exists=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Path to the output of get-suggested-ftd-versions (CSV, JSONL or Parquet) listing the devices to upgrade. By default, the suggested versions of the devices in the selected tenants are looked up first.",
+)
+@click.option(
+    "--wave-size",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="The maximum number of devices to upgrade at the same time. Each wave is finished before the next one starts.",
+)
+@click.option(
+    "--max-per-tenant",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="The maximum number of devices in any one tenant to upgrade at the same time.",
+)
+@click.option(
+    "--wave-pause",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="The number of seconds to wait between waves.",
+)
+@click.option(
+    "--max-failures",
+    type=click.IntRange(min=0),
+    help="Stop before the next wave once more than this many upgrades have failed. By default, every wave is run.",
+)
+@click.option(
+    "--tenant-concurrency",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="The number of tenants to start upgrades in, or look up suggested versions for, concurrently.",
+)
+@click.option(
+    "--results-file",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="Path to a CSV file to record whether each device was upgraded, failed, or was not started.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Show the upgrade waves without starting them."
+)
+@click.option("--yes", is_flag=True, help="Start the upgrades without asking first.")
+@click.pass_context
+def upgrade_devices(
+    ctx: any,
+    input_file: str,
+    wave_size: int,
+    max_per_tenant: int,
+    wave_pause: int,
+    max_failures: int | None,
+    tenant_concurrency: int,
+    results_file: str,
+    dry_run: bool,
+    yes: bool,
+) -> None:
+    """Upgrade FTD devices to their suggested versions, in waves."""
+    from services.inventory_api_service import default_page_concurrency
+    from services.msp_service import MspService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_client_pool import configure_connection_pool, create_api_client
+
+    if not ctx.obj["connection_pool_size"]:
+        configure_connection_pool(
+            tenant_concurrency * (1 + max(max_per_tenant, default_page_concurrency))
+        )
+    if input_file:
+        try:
+            rows = read_output_file(input_file, suggested_ftd_version_columns)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    else:
+        rows = get_suggested_ftd_version_rows(ctx, tenant_concurrency, max_per_tenant)
+    upgrades = [
+        DeviceUpgrade.from_row(row)
+        for row in rows
+        if row[4] != not_found_version and row[5] not in ["", "N/A"]
+    ]
+    if input_file and ctx.obj["tenant_uids"]:
+        tenant_uids = {
+            tenant_uid.strip() for tenant_uid in ctx.obj["tenant_uids"].split(",")
+        }
+        upgrades = [
+            upgrade for upgrade in upgrades if upgrade.tenant_uid in tenant_uids
+        ]
+    if input_file and ctx.obj["shard"]:
+        shard_index, shard_count = ctx.obj["shard"]
+        shard_upgrades = [
+            upgrade
+            for upgrade in upgrades
+            if get_shard_index(upgrade.tenant_uid, shard_count) == shard_index
+        ]
+        get_console().print(
+            f"Shard {shard_index}/{shard_count}: {len(shard_upgrades)} of {len(upgrades)} devices selected."
+        )
+        upgrades = shard_upgrades
+    if not upgrades:
+        get_console().print(
+            "There are no devices with a suggested version to upgrade to."
+        )
+        return
+
+    waves = plan_upgrade_waves(upgrades, wave_size, max_per_tenant)
+    print_upgrade_plan(waves)
+    get_console().print(
+        f"{len(upgrades)} devices in {len({upgrade.tenant_uid for upgrade in upgrades})} tenants will be upgraded in {len(waves)} waves."
+    )
+    if dry_run:
+        return
+    if not yes:
+        click.confirm("Start the upgrades?", abort=True)
+
+    if input_file:
+
+        def get_managed_tenants_by_uid() -> Dict[str, MspManagedTenant]:
+            with create_api_client(
+                ctx.obj["base_url"], ctx.obj["api_token"]
+            ) as api_client:
+                return MspService(api_client).get_managed_tenants_by_uid(
+                    [upgrade.tenant_uid for upgrade in upgrades]
+                )
+
+        managed_tenants_by_uid = call_with_msp_credentials(
+            ctx, get_managed_tenants_by_uid
+        )
+    else:
+        managed_tenants_by_uid = {
+            tenant.uid: tenant for tenant in ctx.obj["managed_tenants"]
+        }
+    ctx.obj["managed_tenants"] = list(managed_tenants_by_uid.values())
+    results_csv_file = (
+        open(results_file, mode="w", newline="", encoding="utf-8")
+        if results_file
+        else None
+    )
+    failures = 0
+    try:
+        results_writer = csv.writer(results_csv_file) if results_csv_file else None
+        if results_writer:
+            results_writer.writerow(upgrade_result_columns)
+        with create_api_client(ctx.obj["base_url"], ctx.obj["api_token"]) as api_client:
             msp_service = MspService(api_client)
-            for tenant in selected_tenants:
-                overall_progress.update(
-                    task_id=tenants_task, tenant_name=tenant.display_name
+            tenant_token_service = TenantTokenService(
+                msp_service, ctx.obj["api_token"], ctx.obj["token_cache"]
+            )
+            with get_progress_display().live:
+                upgrades_task = get_progress_display().overall_progress.add_task(
+                    "Upgrading devices...", total=len(upgrades), tenant_name="TBD"
                 )
-                tenant_api_token = get_api_token_for_user_in_tenant(msp_service, tenant)
-                if tenant_api_token is None:
-                    continue
-                tenant_rows = get_sugggested_ftd_versions_for_tenant(
-                    tenant, ctx.obj["base_url"], tenant_api_token
+                for wave_number, wave in enumerate(waves, start=1):
+                    if max_failures is not None and failures > max_failures:
+                        result_rows = [
+                            to_upgrade_result_row(
+                                upgrade,
+                                "not started",
+                                f"More than {max_failures} upgrades failed",
+                            )
+                            for upgrade in wave
+                        ]
+                    else:
+                        if wave_number > 1 and wave_pause:
+                            time.sleep(wave_pause)
+                        get_progress_display().overall_progress.update(
+                            upgrades_task,
+                            tenant_name=f"wave {wave_number}/{len(waves)}",
+                        )
+                        result_rows = run_upgrade_wave(
+                            tenant_token_service,
+                            managed_tenants_by_uid,
+                            ctx.obj["base_url"],
+                            wave,
+                            upgrades_task,
+                            tenant_concurrency,
+                        )
+                        wave_failures = sum(row[4] != "upgraded" for row in result_rows)
+                        failures += wave_failures
+                        get_console().print(
+                            f"Wave {wave_number}/{len(waves)}: {len(wave) - wave_failures} devices upgraded, {wave_failures} failed."
+                        )
+                    if results_writer:
+                        results_writer.writerows(result_rows)
+                        results_csv_file.flush()
+    finally:
+        if results_csv_file:
+            results_csv_file.close()
+    if max_failures is not None and failures > max_failures:
+        get_console().print(
+            f"Stopped after more than {max_failures} upgrades failed.", style="red"
+        )
+    get_console().print(
+        f"{failures} of {len(upgrades)} upgrades failed.",
+        style="red" if failures else "green",
+    )
+    if results_file:
+        get_console().print(f"Results written to {results_file}", style="green")
+
+
+def run_upgrade_wave(
+    tenant_token_service: TenantTokenService,
+    managed_tenants_by_uid: Dict[str, MspManagedTenant],
+    base_url: str,
+    wave: List[DeviceUpgrade],
+    upgrades_task: TaskID,
+    tenant_concurrency: int,
+) -> List[List[str]]:
+    """Start the upgrades of a wave and wait until all of them have finished."""
+    upgrades_by_tenant_uid: Dict[str, List[DeviceUpgrade]] = {}
+    for upgrade in wave:
+        upgrades_by_tenant_uid.setdefault(upgrade.tenant_uid, []).append(upgrade)
+
+    result_rows = []
+    for tenant_uid, tenant_upgrades in list(upgrades_by_tenant_uid.items()):
+        if tenant_uid not in managed_tenants_by_uid:
+            del upgrades_by_tenant_uid[tenant_uid]
+            result_rows.extend(
+                to_upgrade_result_row(
+                    upgrade, "failed", "The tenant is not managed by this MSSP portal"
                 )
-                for tenant_row in tenant_rows:
-                    table.add_row(*tenant_row)
-                    csv_rows.append(tenant_row)
-                overall_progress.update(tenants_task, advance=1)
+                for upgrade in tenant_upgrades
+            )
+            get_progress_display().overall_progress.update(
+                upgrades_task, advance=len(tenant_upgrades)
+            )
+    for tenant_result_rows in ordered_map(
+        lambda item: upgrade_devices_in_tenant(
+            tenant_token_service,
+            managed_tenants_by_uid[item[0]],
+            base_url,
+            item[1],
+            upgrades_task,
+        ),
+        upgrades_by_tenant_uid.items(),
+        max_workers=tenant_concurrency,
+    ):
+        result_rows.extend(tenant_result_rows)
+    return result_rows
+
+
+def describe_provisioning_error(error: Exception) -> str:
+    from scc_firewall_manager_sdk.exceptions import (
+        ForbiddenException,
+        UnauthorizedException,
+    )
+
+    if isinstance(error, UnauthorizedException):
+        return "The token used to connect the tenant to the MSSP portal is invalid. Please delete and re-onboard this tenant using the SCC Firewall MSSP portal."
+    if isinstance(error, ForbiddenException):
+        return "The token used to connect the tenant to the MSSP portal is not a super-admin token. Please delete and re-onboard this tenant using the SCC Firewall MSSP portal."
+    return describe_error(error)
+
+
+@click.command(name="provision-api-users")
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="The number of tenants to look up, create users in, and poll transactions for concurrently.",
+)
+@click.option(
+    "--results-file",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="Path to a CSV file to record whether each tenant already had the user, had it created, or failed.",
+)
+@click.pass_context
+def provision_api_users(ctx: any, concurrency: int, results_file: str) -> None:
+    """
+    Create the API-only user that the CLI generates tenant tokens for in every selected
+    tenant that doesn't have it yet, all at once, so that later runs don't have to
+    create it the first time they touch each tenant.
+    """
+    from services.msp_service import MspService
+    from utils.api_client_pool import configure_connection_pool, create_api_client
+
+    if not ctx.obj["connection_pool_size"]:
+        configure_connection_pool(concurrency)
+    selected_tenants = resolve_managed_tenants(ctx)
+    tenants_by_uid = {tenant.uid: tenant for tenant in selected_tenants}
+    get_console().print(
+        f"Provisioning API-only users in {len(selected_tenants)} managed tenants..."
+    )
+
+    results_csv_file = (
+        open(results_file, mode="w", newline="", encoding="utf-8")
+        if results_file
+        else None
+    )
+    status_counts = {"present": 0, "created": 0, "failed": 0}
+    try:
+        results_writer = csv.writer(results_csv_file) if results_csv_file else None
+        if results_writer:
+            results_writer.writerow(["Tenant UID", "Tenant Name", "Status", "Reason"])
+        with get_progress_display().live:
+            tenants_task = get_progress_display().overall_progress.add_task(
+                "Provisioning API-only users...",
+                total=len(selected_tenants),
+                tenant_name="TBD",
+            )
+            with create_api_client(
+                ctx.obj["base_url"], ctx.obj["api_token"]
+            ) as api_client:
+                for tenant_uid, status, error in MspService(
+                    api_client
+                ).provision_api_only_users(
+                    selected_tenants, max_concurrency=concurrency
+                ):
+                    tenant = tenants_by_uid[tenant_uid]
+                    status_counts[status] += 1
+                    reason = describe_provisioning_error(error) if error else ""
+                    get_progress_display().overall_progress.update(
+                        tenants_task, advance=1, tenant_name=tenant.display_name
+                    )
+                    if error:
+                        get_console().print(
+                            f"\nFailed to provision tenant {tenant.display_name} ({tenant_uid}): {reason}",
+                            style="red",
+                        )
+                    if results_writer:
+                        results_writer.writerow(
+                            [tenant_uid, tenant.display_name, status, reason]
+                        )
+                        results_csv_file.flush()
+    finally:
+        if results_csv_file:
+            results_csv_file.close()
+    get_console().print(
+        f"{status_counts['created']} users created, {status_counts['present']} already present, {status_counts['failed']} tenants failed.",
+        style="red" if status_counts["failed"] else "green",
+    )
+    if results_file:
+        get_console().print(f"Results written to {results_file}", style="green")
+
+
+default_device_query_columns = [
+    "tenant_name",
+    "tenant_uid",
+    "name",
+    "uid",
+    "device_type",
+    "model_number",
+    "software_version",
+    "connectivity_state",
+]
+
+
+def to_device_query_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def query_devices_in_managed_tenant(
+    tenant_token_service: TenantTokenService,
+    tenant: MspManagedTenant,
+    base_url: str,
+    q: str | None,
+    columns: List[str],
+    field_keys: Dict[str, str],
+    page_concurrency: int,
+    tenants_task: TaskID | None,
+) -> List[List[str]] | None:
+    """
+    Get the requested columns of the devices matching q in a tenant. Returns None if
+    the tenant had to be skipped.
+    """
+    from services.inventory_api_service import InventoryApiService
+    from utils.api_client_pool import create_api_client
+    from utils.retry_policy import request_errors
+
+    tenant_values = {"tenant_name": tenant.display_name, "tenant_uid": tenant.uid}
+    if tenants_task is not None:
+        get_progress_display().overall_progress.update(
+            task_id=tenants_task, tenant_name=tenant.display_name
+        )
+
+    def query_devices(tenant_api_token: str) -> List[List[str]]:
+        with create_api_client(
+            base_url, tenant_api_token, tenant_uid=tenant.uid
+        ) as tenant_api_client:
+            return [
+                [
+                    (
+                        tenant_values[column]
+                        if column in tenant_values
+                        else to_device_query_value(device.get(field_keys[column]))
+                    )
+                    for column in columns
+                ]
+                for device in InventoryApiService(tenant_api_client).iter_device_dicts(
+                    q=q, page_concurrency=page_concurrency
+                )
+            ]
+
+    try:
+        return call_with_tenant_token(tenant_token_service, tenant, query_devices)
+    except request_errors as e:
+        get_console().print(
+            f"\nSkipping tenant {tenant.display_name} ({tenant.uid}): {describe_error(e)}",
+            style="red",
+        )
+        return None
+    finally:
+        if tenants_task is not None:
+            get_progress_display().overall_progress.update(tenants_task, advance=1)
+
 
-    console.print(table)
-    # Write to CSV if output file is specified
+@click.command(name="query-devices")
+@click.option(
+    "--q",
+    help='The inventory query to run in each tenant, in Lucene syntax, such as "deviceType:CDFMC_MANAGED_FTD AND softwareVersion:7.0.6". By default, every device is returned.',
+)
+@click.option(
+    "--columns",
+    default=",".join(default_device_query_columns),
+    show_default=True,
+    help="The fields of each device to output, separated by commas: tenant_name, tenant_uid, or any field of a device, such as serial or connectivity_state.",
+)
+@click.option(
+    "--output-file",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="Path to the output file. By default, rows are written to stdout as CSV.",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(output_formats),
+    default="csv",
+    show_default=True,
+    help="The format of the output file.",
+)
+@click.option(
+    "--tenant-concurrency",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="The number of tenants to query concurrently.",
+)
+@click.option(
+    "--page-concurrency",
+    type=click.IntRange(min=1),
+    help="The number of pages of devices to fetch concurrently in each tenant.",
+)
+@click.pass_context
+def query_devices_in_tenants(
+    ctx: any,
+    q: str | None,
+    columns: str,
+    output_file: str | None,
+    output_format: str,
+    tenant_concurrency: int,
+    page_concurrency: int | None,
+) -> None:
+    """
+    Run an inventory query in every selected tenant and output the chosen columns of
+    the matching devices, tenant by tenant, as soon as each tenant has been queried.
+    """
+    from services.inventory_api_service import (
+        default_page_concurrency,
+        get_device_field_keys,
+    )
+    from services.msp_service import MspService
+    from services.tenant_token_service import TenantTokenService
+    from utils.api_client_pool import configure_connection_pool, create_api_client
+
+    field_keys = get_device_field_keys()
+    column_list = [column.strip() for column in columns.split(",") if column.strip()]
+    unknown_columns = [
+        column
+        for column in column_list
+        if column not in field_keys and column not in ["tenant_name", "tenant_uid"]
+    ]
+    if not column_list or unknown_columns:
+        raise click.BadParameter(
+            f"Unknown columns: {', '.join(unknown_columns) or '(none given)'}. Use tenant_name, tenant_uid or any of: {', '.join(field_keys)}",
+            param_hint="--columns",
+        )
+    if not output_file:
+        # rows go to stdout, so everything else goes to stderr
+        get_console().file = sys.stderr
+    page_concurrency = page_concurrency or default_page_concurrency
+    if not ctx.obj["connection_pool_size"]:
+        configure_connection_pool(tenant_concurrency * (1 + page_concurrency))
+    selected_tenants = resolve_managed_tenants(ctx)
+
+    # with rows going to stdout, the progress display would get in their way
+    output_writer = stdout_writer = None
     if output_file:
-        write_output_to_csv(output_file, csv_rows)
+        try:
+            output_writer = create_output_writer(
+                output_format, output_file, column_list
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    else:
+        stdout_writer = csv.writer(sys.stdout)
+        stdout_writer.writerow(column_list)
+    live = get_progress_display().live if output_file else nullcontext()
+    row_count = skipped_tenant_count = 0
+    try:
+        with live:
+            tenants_task = (
+                get_progress_display().overall_progress.add_task(
+                    "Querying tenants...",
+                    total=len(selected_tenants),
+                    tenant_name="TBD",
+                )
+                if output_file
+                else None
+            )
+            with create_api_client(
+                ctx.obj["base_url"], ctx.obj["api_token"]
+            ) as api_client:
+                tenant_token_service = TenantTokenService(
+                    MspService(api_client),
+                    ctx.obj["api_token"],
+                    ctx.obj["token_cache"],
+                )
+                for tenant_rows in ordered_map(
+                    lambda tenant: query_devices_in_managed_tenant(
+                        tenant_token_service,
+                        tenant,
+                        ctx.obj["base_url"],
+                        q,
+                        column_list,
+                        field_keys,
+                        page_concurrency,
+                        tenants_task,
+                    ),
+                    selected_tenants,
+                    max_workers=tenant_concurrency,
+                ):
+                    if tenant_rows is None:
+                        skipped_tenant_count += 1
+                        continue
+                    row_count += len(tenant_rows)
+                    if output_writer:
+                        output_writer.write_rows(tenant_rows)
+                    else:
+                        stdout_writer.writerows(tenant_rows)
+                        sys.stdout.flush()
+    finally:
+        if output_writer:
+            output_writer.close()
+    summary = (
+        f"{row_count} devices in {len(selected_tenants) - skipped_tenant_count} tenants"
+    )
+    if skipped_tenant_count:
+        summary += f", {skipped_tenant_count} tenants skipped"
+    if output_file:
+        get_console().print(f"{summary} written to {output_file}", style="green")
+    else:
+        click.echo(summary, err=True)
+
+
+@click.command(name="merge")
+@click.argument(
+    "input_files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--output-file",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    required=True,
+    help="Path to the merged output file.",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(output_formats),
+    default="csv",
+    show_default=True,
+    help="The format of the merged output file.",
+)
+@click.pass_context
+def merge_shard_outputs(
+    ctx: any, input_files: Tuple[str, ...], output_file: str, output_format: str
+) -> None:
+    """
+    Merge the output files of get-suggested-ftd-versions runs using --shard into one
+    file, sorted by tenant and device, and report tenants that are missing from every
+    shard or were processed by more than one. Exits with status 1 if any are missing.
+    """
+    # the rows of each tenant are taken from the first file that has it
+    rows_by_tenant_uid = {}
+    input_files_by_tenant_uid = {}
+    selected_tenant_uids = set()
+    shards = {}
+    for input_file in input_files:
+        try:
+            rows = read_output_file(input_file, suggested_ftd_version_columns)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        file_rows_by_tenant_uid = {}
+        for row in rows:
+            file_rows_by_tenant_uid.setdefault(row[1], []).append(row)
+        tenant_uids = set(file_rows_by_tenant_uid)
+        manifest_path = get_manifest_path(input_file)
+        if os.path.exists(manifest_path):
+            manifest = ShardManifest.load(manifest_path)
+            tenant_uids.update(manifest.completed_tenant_uids)
+            selected_tenant_uids.update(manifest.selected_tenant_uids)
+            shards.setdefault((manifest.shard_index, manifest.shard_count), []).append(
+                input_file
+            )
+        else:
+            get_console().print(
+                f"{input_file} has no shard manifest, so tenants without devices in it can't be accounted for.",
+                style="yellow",
+            )
+        for tenant_uid in tenant_uids:
+            input_files_by_tenant_uid.setdefault(tenant_uid, []).append(input_file)
+            rows_by_tenant_uid.setdefault(
+                tenant_uid, file_rows_by_tenant_uid.get(tenant_uid, [])
+            )
+
+    # rows without a suggested version name their tenant by its name rather than its
+    # display name, so tenants are sorted by one name each to keep their rows together
+    tenant_names = {}
+    for tenant_uid, rows in rows_by_tenant_uid.items():
+        found_rows = [row for row in rows if row[4] != not_found_version]
+        tenant_names[tenant_uid] = (found_rows or rows)[0][0].lower() if rows else ""
+    merged_rows = sorted(
+        (row for rows in rows_by_tenant_uid.values() for row in rows),
+        key=lambda row: (tenant_names[row[1]], row[1], row[2].lower(), row[3]),
+    )
+    try:
+        with create_output_writer(
+            output_format, output_file, suggested_ftd_version_columns
+        ) as output_writer:
+            output_writer.write_rows(merged_rows)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    get_console().print(
+        f"Merged {len(merged_rows)} rows for {len(rows_by_tenant_uid)} tenants from {len(input_files)} files into {output_file}",
+        style="green",
+    )
+
+    shard_counts = {shard_count for _, shard_count in shards}
+    if len(shard_counts) > 1:
+        get_console().print(
+            f"The files come from runs with different numbers of shards: {sorted(shard_counts)}",
+            style="yellow",
+        )
+    for shard_count in shard_counts:
+        missing_shards = [
+            f"{shard_index}/{shard_count}"
+            for shard_index in range(1, shard_count + 1)
+            if (shard_index, shard_count) not in shards
+        ]
+        if missing_shards:
+            get_console().print(
+                f"No output for shards: {', '.join(missing_shards)}", style="yellow"
+            )
+    duplicated_tenant_uids = {
+        tenant_uid: files
+        for tenant_uid, files in input_files_by_tenant_uid.items()
+        if len(files) > 1
+    }
+    for tenant_uid, files in sorted(duplicated_tenant_uids.items()):
+        get_console().print(
+            f"Tenant {tenant_uid} is in more than one file, kept the rows from {files[0]}: {', '.join(files)}",
+            style="yellow",
+        )
+    missing_tenant_uids = sorted(
+        selected_tenant_uids - input_files_by_tenant_uid.keys()
+    )
+    for tenant_uid in missing_tenant_uids:
+        get_console().print(f"Tenant {tenant_uid} is missing", style="red")
+    if missing_tenant_uids:
+        get_console().print(
+            f"{len(missing_tenant_uids)} of {len(selected_tenant_uids)} selected tenants are missing.",
+            style="red",
+        )
+        ctx.exit(1)
 
 
 cli.add_command(get_suggested_ftd_versions)
 cli.add_command(add_tenants_to_msp)
+cli.add_command(refresh_inventory)
+cli.add_command(query_inventory)
+cli.add_command(serve_inventory)
+cli.add_command(merge_shard_outputs)
+cli.add_command(upgrade_devices)
+cli.add_command(provision_api_users)
+cli.add_command(query_devices_in_tenants)
 if __name__ == "__main__":
     cli(obj={})
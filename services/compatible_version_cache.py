@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+from scc_firewall_manager_sdk import Device, FtdVersion
+
+from utils.file_cache import FileCache
+
+
+class CompatibleVersionCache:
+    """
+    Remembers the suggested FTD version for devices that share the attributes that
+    determine which versions they are compatible with, so that identical devices cost
+    one lookup per run (or none, if the optional on-disk layer is warm).
+
+    Upgrade packages are specific to a tenant's cdFMC, so devices are only considered
+    identical within a tenant. Lookups that find no suggested version are not shared,
+    as they may be caused by a problem with that one device.
+    """
+
+    def __init__(self, file_cache: FileCache | None = None, ttl_seconds: int = 0):
+        self.file_cache = file_cache
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._lookups: Dict[str, Future] = {}
+
+    @staticmethod
+    def get_cache_key(tenant_uid: str, device: Device) -> str | None:
+        model = device.model_number or device.hardware_model
+        if not model or not device.software_version:
+            # not enough information to tell whether another device is identical
+            return None
+        return ":".join(
+            [tenant_uid, str(device.device_type), model, device.software_version]
+        )
+
+    def get_or_fetch(
+        self, cache_key: str, fetch: Callable[[], FtdVersion | None]
+    ) -> FtdVersion | None:
+        with self._lock:
+            lookup = self._lookups.get(cache_key)
+            is_owner = lookup is None
+            if is_owner:
+                lookup = Future()
+                self._lookups[cache_key] = lookup
+
+        if not is_owner:
+            # an identical device has been (or is being) looked up; wait for it
+            try:
+                ftd_version = lookup.result()
+            except Exception:
+                ftd_version = None
+            return ftd_version if ftd_version is not None else fetch()
+
+        try:
+            ftd_version = self._get_from_file_cache(cache_key)
+            if ftd_version is None:
+                ftd_version = fetch()
+                self._put_in_file_cache(cache_key, ftd_version)
+        except Exception as e:
+            self._forget(cache_key)
+            lookup.set_exception(e)
+            raise
+        if ftd_version is None:
+            self._forget(cache_key)
+        lookup.set_result(ftd_version)
+        return ftd_version
+
+    def flush(self) -> None:
+        """Write the versions looked up so far to the on-disk layer, if there is one."""
+        if self.file_cache is not None:
+            self.file_cache.flush()
+
+    def _forget(self, cache_key: str) -> None:
+        with self._lock:
+            self._lookups.pop(cache_key, None)
+
+    def _get_from_file_cache(self, cache_key: str) -> FtdVersion | None:
+        if self.file_cache is None or self.ttl_seconds <= 0:
+            return None
+        cached_ftd_version = self.file_cache.get(cache_key)
+        return (
+            FtdVersion.from_dict(cached_ftd_version)
+            if cached_ftd_version is not None
+            else None
+        )
+
+    def _put_in_file_cache(self, cache_key: str, ftd_version: FtdVersion | None):
+        if self.file_cache is None or ftd_version is None or self.ttl_seconds <= 0:
+            return
+        self.file_cache.set(
+            cache_key, ftd_version.to_dict(), expires_at=time.time() + self.ttl_seconds
+        )
@@ -1,10 +1,51 @@
-from scc_firewall_manager_sdk import DeviceUpgradesApi, FtdVersionsResponse
-from scc_firewall_manager_sdk.exceptions import NotFoundException, ServiceException
+from typing import Dict, Iterator, Tuple
+
+from scc_firewall_manager_sdk import (
+    DeviceUpgradesApi,
+    FtdVersionsResponse,
+    Device,
+    FtdVersion,
+    UpgradeFtdDeviceInput,
+)
+from scc_firewall_manager_sdk.exceptions import (
+    NotFoundException,
+    ServiceException,
+    UnauthorizedException,
+)
+
+from services.compatible_version_cache import CompatibleVersionCache
+from services.transaction_service import TransactionService
+from utils.retry_policy import request_errors
 
 
 class DeviceUpgradeService:
-    def __init__(self, api_client):
+    def __init__(
+        self,
+        api_client,
+        compatible_version_cache: CompatibleVersionCache | None = None,
+    ):
         self.device_upgrades_api: DeviceUpgradesApi = DeviceUpgradesApi(api_client)
+        self.transaction_service: TransactionService = TransactionService(api_client)
+        self.compatible_version_cache = compatible_version_cache
+
+    def get_suggested_compatible_version_for_device(
+        self, device: Device, tenant_uid: str
+    ) -> FtdVersion | None:
+        """
+        Get the suggested version for a device, reusing the answer for an identical
+        device if a compatible version cache is configured.
+        """
+        cache_key = (
+            CompatibleVersionCache.get_cache_key(tenant_uid, device)
+            if self.compatible_version_cache is not None
+            else None
+        )
+        if cache_key is None:
+            return self.get_suggested_compatible_version(device_uid=device.uid)
+        return self.compatible_version_cache.get_or_fetch(
+            cache_key,
+            lambda: self.get_suggested_compatible_version(device_uid=device.uid),
+        )
 
     def get_suggested_compatible_version(self, device_uid: str):
         try:
@@ -27,3 +68,52 @@ class DeviceUpgradeService:
                 break
 
         return suggested_ftd_version
+
+    def submit_upgrade(self, device_uid: str, upgrade_package_uid: str) -> str:
+        """
+        Start upgrading a device, without waiting for it to finish. Returns the UID of
+        the transaction to wait on.
+        """
+        cdo_transaction = self.device_upgrades_api.upgrade_ftd_device(
+            device_uid=device_uid,
+            upgrade_ftd_device_input=UpgradeFtdDeviceInput(
+                upgrade_package_uid=upgrade_package_uid
+            ),
+        )
+        return cdo_transaction.transaction_uid
+
+    def upgrade_devices(
+        self,
+        upgrade_package_uids_by_device_uid: Dict[str, str],
+        max_concurrency: int = 8,
+        max_poll_delay_seconds: float = 30,
+    ) -> Iterator[Tuple[str, Exception | None]]:
+        """
+        Upgrade many devices: start all of the upgrades first, then wait for their
+        transactions together. Yields (device UID, error) for each device as it
+        finishes; error is None if the device was upgraded. If the token is rejected
+        when starting the first upgrade, the UnauthorizedException is raised instead,
+        as nothing has been started yet and every device would fail alike.
+        """
+        device_uids_by_transaction_uid = {}
+        for index, (device_uid, upgrade_package_uid) in enumerate(
+            upgrade_package_uids_by_device_uid.items()
+        ):
+            try:
+                transaction_uid = self.submit_upgrade(device_uid, upgrade_package_uid)
+            except request_errors as e:
+                if index == 0 and isinstance(e, UnauthorizedException):
+                    raise
+                yield device_uid, e
+                continue
+            device_uids_by_transaction_uid[transaction_uid] = device_uid
+
+        # upgrades take minutes, so there is no point polling them as often as other
+        # transactions
+        results = self.transaction_service.wait_for_transactions_to_finish(
+            device_uids_by_transaction_uid.keys(),
+            max_concurrency=max_concurrency,
+            max_delay_seconds=max_poll_delay_seconds,
+        )
+        for transaction_uid, _, error in results:
+            yield device_uids_by_transaction_uid[transaction_uid], error
@@ -1,4 +1,5 @@
-from typing import List
+import json
+from typing import Dict, Iterator, List
 
 from scc_firewall_manager_sdk import (
     InventoryApi,
@@ -6,6 +7,17 @@ from scc_firewall_manager_sdk import (
     Device,
     DevicePage,
 )
+from scc_firewall_manager_sdk.exceptions import ApiException
+from scc_firewall_manager_sdk.rest import RESTResponse
+
+from utils.concurrency import ordered_map
+
+default_page_concurrency = 4
+
+
+def get_device_field_keys() -> Dict[str, str]:
+    """Map the field names of Device, such as software_version, to their keys in the JSON of the API."""
+    return {name: field.alias or name for name, field in Device.model_fields.items()}
 
 
 class InventoryApiService:
@@ -13,18 +25,69 @@ class InventoryApiService:
         self.api_client = api_client
         self.inventory_api = InventoryApi(api_client)
 
-    def get_devices(self, q: str = None) -> List[Device]:
-        devices: List[Device] = []
-        offset: int = 0
-        limit: int = 200
-        while True:
-            device_page: DevicePage = self.inventory_api.get_devices(
+    def get_devices(
+        self, q: str = None, page_concurrency: int = default_page_concurrency
+    ) -> List[Device]:
+        return list(self.iter_devices(q=q, page_concurrency=page_concurrency))
+
+    def iter_devices(
+        self,
+        q: str = None,
+        limit: int = 200,
+        page_concurrency: int = default_page_concurrency,
+    ) -> Iterator[Device]:
+        """
+        Yield devices page by page, in order. The first page tells us how many devices
+        there are, so the remaining pages are requested concurrently, with at most
+        page_concurrency requests in flight.
+        """
+        first_page: DevicePage = self._get_device_page(q=q, limit=limit, offset=0)
+        yield from first_page.items or []
+        offsets = range(limit, first_page.count or 0, limit)
+        for device_page in ordered_map(
+            lambda offset: self._get_device_page(q=q, limit=limit, offset=offset),
+            offsets,
+            max_workers=page_concurrency,
+            max_in_flight=page_concurrency,
+        ):
+            yield from device_page.items or []
+
+    def _get_device_page(self, q: str, limit: int, offset: int) -> DevicePage:
+        return self.inventory_api.get_devices(limit=str(limit), offset=str(offset), q=q)
+
+    def iter_device_dicts(
+        self,
+        q: str = None,
+        limit: int = 200,
+        page_concurrency: int = default_page_concurrency,
+    ) -> Iterator[dict]:
+        """
+        Like iter_devices, but yield the JSON of each device as returned by the API,
+        without building a Device from it, which costs far more than the request
+        itself when only a few fields are needed.
+        """
+        first_page = self._get_device_page_json(q=q, limit=limit, offset=0)
+        yield from first_page.get("items") or []
+        offsets = range(limit, first_page.get("count") or 0, limit)
+        for device_page in ordered_map(
+            lambda offset: self._get_device_page_json(q=q, limit=limit, offset=offset),
+            offsets,
+            max_workers=page_concurrency,
+            max_in_flight=page_concurrency,
+        ):
+            yield from device_page.get("items") or []
+
+    def _get_device_page_json(self, q: str, limit: int, offset: int) -> dict:
+        response = RESTResponse(
+            self.inventory_api.get_devices_without_preload_content(
                 limit=str(limit), offset=str(offset), q=q
             )
-            devices.extend(device_page.items)
-            count = device_page.count
-            offset += limit
-            if len(devices) >= count:
-                break
-
-        return devices
+        )
+        response.read()
+        if not 200 <= response.status <= 299:
+            raise ApiException.from_response(
+                http_resp=response,
+                body=response.data.decode("utf-8", errors="replace"),
+                data=None,
+            )
+        return json.loads(response.data)
@@ -1,4 +1,5 @@
-from typing import List
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 from scc_firewall_manager_sdk import CdoTransaction, ApiTokenInfo
 from scc_firewall_manager_sdk import (
@@ -9,35 +10,148 @@ from scc_firewall_manager_sdk import (
     UserInput,
     UserRole,
     User,
+    MspManagedTenantPage,
 )
+from scc_firewall_manager_sdk.exceptions import ApiException, NotFoundException
 
 from services.transaction_service import TransactionService
+from utils.concurrency import ordered_map
+from utils.file_cache import FileCache, digest
+from utils.retry_policy import request_errors
 
 
 class MspService:
-    def __init__(self, api_client):
+    def __init__(
+        self,
+        api_client,
+        tenant_list_cache: FileCache | None = None,
+        tenant_list_cache_ttl_seconds: int = 0,
+    ):
+        self.api_client = api_client
         self.msp_api: MSPApi = MSPApi(api_client)
         self.transaction_service: TransactionService = TransactionService(api_client)
+        self.tenant_list_cache = tenant_list_cache
+        self.tenant_list_cache_ttl_seconds = tenant_list_cache_ttl_seconds
 
     def get_managed_tenants(self) -> List[MspManagedTenant]:
-        return self.do_get_managed_tenants(limit=50, offset=0)
-
-    def do_get_managed_tenants(
-        self, limit: int = 50, offset: int = 0, managed_tenants=None
-    ) -> List[MspManagedTenant]:
-        if managed_tenants is None:
-            managed_tenants = []
-        managed_tenants_response = self.msp_api.get_msp_managed_tenants(
-            limit=str(limit), offset=str(offset)
+        """
+        Get all the tenants managed by the MSP portal. If a tenant list cache is
+        configured, a snapshot younger than the TTL is returned instead of listing
+        the tenants again.
+        """
+        cached_tenants = self._get_cached_managed_tenants()
+        if cached_tenants is not None:
+            return cached_tenants
+
+        managed_tenants = list(self.iter_managed_tenants())
+        if (
+            self.tenant_list_cache is not None
+            and self.tenant_list_cache_ttl_seconds > 0
+        ):
+            self.tenant_list_cache.set(
+                self._tenant_list_cache_key(),
+                [tenant.to_dict() for tenant in managed_tenants],
+                expires_at=time.time() + self.tenant_list_cache_ttl_seconds,
+            )
+            # the snapshot is meant for later commands, and this one may not exit cleanly
+            self.tenant_list_cache.flush()
+        return managed_tenants
+
+    def get_managed_tenants_by_uid(
+        self, tenant_uids: Iterable[str], max_concurrency: int = 8
+    ) -> Dict[str, MspManagedTenant]:
+        """
+        Look up the given managed tenants directly (and concurrently), rather than
+        listing every tenant in the portal. Tenants found in a snapshot of the tenant
+        list are taken from it; the others are still looked up, as they may have been
+        added to the portal since the snapshot was taken. UIDs of tenants that aren't
+        managed by the portal are left out of the result.
+        """
+        unique_tenant_uids = list(dict.fromkeys(tenant_uids))
+        cached_tenants_by_uid = {
+            tenant.uid: tenant for tenant in self._get_cached_managed_tenants() or []
+        }
+        uncached_tenant_uids = [
+            tenant_uid
+            for tenant_uid in unique_tenant_uids
+            if tenant_uid not in cached_tenants_by_uid
+        ]
+        looked_up_tenants_by_uid = dict(
+            zip(
+                uncached_tenant_uids,
+                ordered_map(
+                    self._get_managed_tenant_or_none,
+                    uncached_tenant_uids,
+                    max_workers=max_concurrency,
+                ),
+            )
         )
-        if managed_tenants_response.count > offset + limit:
-            return self.do_get_managed_tenants(
-                limit, offset + limit, managed_tenants + managed_tenants_response.items
+
+        managed_tenants_by_uid = {}
+        for tenant_uid in unique_tenant_uids:
+            managed_tenant = cached_tenants_by_uid.get(
+                tenant_uid, looked_up_tenants_by_uid.get(tenant_uid)
             )
-        else:
-            return managed_tenants + managed_tenants_response.items
+            if managed_tenant is not None:
+                managed_tenants_by_uid[tenant_uid] = managed_tenant
+        return managed_tenants_by_uid
+
+    def _get_managed_tenant_or_none(self, tenant_uid: str) -> MspManagedTenant | None:
+        try:
+            return self.msp_api.get_msp_managed_tenant(tenant_uid)
+        except NotFoundException:
+            return None
+
+    def _get_cached_managed_tenants(self) -> List[MspManagedTenant] | None:
+        if self.tenant_list_cache is None or self.tenant_list_cache_ttl_seconds <= 0:
+            return None
+        cached_tenants = self.tenant_list_cache.get(self._tenant_list_cache_key())
+        if cached_tenants is None:
+            return None
+        return [MspManagedTenant.from_dict(tenant) for tenant in cached_tenants]
+
+    def forget_managed_tenants(self) -> None:
+        """Drop the snapshot of the tenant list, e.g. after a tenant has been added."""
+        if self.tenant_list_cache is not None:
+            self.tenant_list_cache.delete(self._tenant_list_cache_key())
+
+    def iter_managed_tenants(
+        self, limit: int = 50, page_concurrency: int = 4
+    ) -> Iterator[MspManagedTenant]:
+        """
+        Yield the managed tenants page by page, in order. Once the first page has
+        told us how many tenants there are, the remaining pages are fetched
+        concurrently.
+        """
+        first_page = self._get_managed_tenant_page(limit=limit, offset=0)
+        yield from first_page.items or []
+        for managed_tenant_page in ordered_map(
+            lambda offset: self._get_managed_tenant_page(limit=limit, offset=offset),
+            range(limit, first_page.count or 0, limit),
+            max_workers=page_concurrency,
+            max_in_flight=page_concurrency,
+        ):
+            yield from managed_tenant_page.items or []
+
+    def _get_managed_tenant_page(self, limit: int, offset: int) -> MspManagedTenantPage:
+        return self.msp_api.get_msp_managed_tenants(
+            limit=str(limit), offset=str(offset)
+        )
+
+    def _tenant_list_cache_key(self) -> str:
+        configuration = self.api_client.configuration
+        return digest(f"{configuration.host}:{configuration.access_token}")
 
     def create_api_only_user(self, tenant_uid: str, username: str) -> None:
+        self.transaction_service.wait_for_transaction_to_finish(
+            self.submit_create_api_only_user(tenant_uid=tenant_uid, username=username)
+        )
+
+    def submit_create_api_only_user(self, tenant_uid: str, username: str) -> str:
+        """
+        Start creating an API-only user in a tenant, without waiting for it to finish.
+        Returns the UID of the transaction to wait on.
+        """
         msp_add_users_to_tenant_input: MspAddUsersToTenantInput = (
             MspAddUsersToTenantInput(
                 users=[
@@ -55,9 +169,66 @@ class MspService:
                 msp_add_users_to_tenant_input=msp_add_users_to_tenant_input,
             )
         )
-        self.transaction_service.wait_for_transaction_to_finish(
-            cdo_transaction.transaction_uid
+        return cdo_transaction.transaction_uid
+
+    def provision_api_only_users(
+        self,
+        tenants: List[MspManagedTenant],
+        username: str = "cli_user",
+        max_concurrency: int = 8,
+    ) -> Iterator[Tuple[str, str, Exception | None]]:
+        """
+        Make sure every tenant has the API-only user that tokens are generated for:
+        look the user up in all tenants concurrently, start creating it in the tenants
+        that don't have it as soon as each lookup finishes, then wait for all of the
+        transactions together. Yields (tenant UID, status, error) for each tenant, where
+        status is "present", "created" or "failed".
+        """
+        tenant_uids_by_transaction_uid = {}
+        for tenant, (transaction_uid, error) in zip(
+            tenants,
+            ordered_map(
+                lambda tenant: self._submit_create_api_only_user_if_missing(
+                    tenant, username
+                ),
+                tenants,
+                max_workers=max_concurrency,
+            ),
+        ):
+            if error is not None:
+                yield tenant.uid, "failed", error
+            elif transaction_uid is None:
+                yield tenant.uid, "present", None
+            else:
+                tenant_uids_by_transaction_uid[transaction_uid] = tenant.uid
+
+        results = self.transaction_service.wait_for_transactions_to_finish(
+            tenant_uids_by_transaction_uid.keys(), max_concurrency=max_concurrency
         )
+        for transaction_uid, _, error in results:
+            yield (
+                tenant_uids_by_transaction_uid[transaction_uid],
+                "created" if error is None else "failed",
+                error,
+            )
+
+    def _submit_create_api_only_user_if_missing(
+        self, tenant: MspManagedTenant, username: str
+    ) -> Tuple[str | None, Exception | None]:
+        try:
+            user = self.get_user_by_name_in_tenant_in_msp_portal(
+                tenant_uid=tenant.uid, username=f"{username}@{tenant.name}"
+            )
+            if user is not None:
+                return None, None
+            return (
+                self.submit_create_api_only_user(
+                    tenant_uid=tenant.uid, username=username
+                ),
+                None,
+            )
+        except request_errors as e:
+            return None, e
 
     def get_user_by_name_in_tenant_in_msp_portal(
         self, tenant_uid: str, username: str
@@ -98,13 +269,23 @@ class MspService:
         """
         Add a tenant to the MSP portal.
         """
+        transaction_uid = self.submit_add_tenant(tenant_uid)
+        if transaction_uid is not None:
+            self.transaction_service.wait_for_transaction_to_finish(transaction_uid)
+            self.forget_managed_tenants()
+
+    def submit_add_tenant(self, tenant_uid: str) -> str | None:
+        """
+        Start adding a tenant to the MSP portal, without waiting for it to finish.
+        Returns the UID of the transaction to wait on, or None if the tenant is
+        already managed by the MSP portal.
+        """
         try:
             cdo_transaction = self.msp_api.add_tenant_to_msp_portal(
                 tenant_uid=tenant_uid
             )
-            self.transaction_service.wait_for_transaction_to_finish(
-                cdo_transaction.transaction_uid
-            )
-        except Exception as e:
+        except ApiException as e:
             if e.reason != "Conflict":
                 raise e
+            return None
+        return cdo_transaction.transaction_uid
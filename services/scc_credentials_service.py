@@ -1,26 +1,39 @@
-# services/scc_credentials_service.py
 import os
+import time
+
+import jwt
 import yaml
 from services.token_validation_service import TokenValidationService
-from utils.interactive_cli import get_region_and_api_token
+from utils.file_cache import FileCache, digest
 from utils.region_mapping import get_scc_url
 
 
 class SccCredentialsService:
     def __init__(
-        self, config_file_path="~/.cisco-security.yaml", region=None, api_token=None
+        self,
+        config_file_path="~/.cisco-security.yaml",
+        region=None,
+        api_token=None,
+        validation_ttl_seconds=3600,
     ):
         self.config_file_path = os.path.expanduser(config_file_path)
         self.region = region
         self.api_token = api_token
         self.base_url = None
+        # remember successful validations next to the config file, so that scripted
+        # runs don't pay for a validation round trip every time the CLI starts
+        self.validation_cache = FileCache(
+            ".cisco-security-validation.json",
+            cache_dir=os.path.dirname(self.config_file_path),
+            max_entries=16,
+        )
+        self.validation_ttl_seconds = validation_ttl_seconds
+        self.credentials_provided = bool(region and api_token)
 
     def load_or_prompt_credentials(self):
-        if self.region and self.api_token:
+        if self.credentials_provided:
             self.map_region_to_base_url()
-            if not TokenValidationService(
-                self.base_url, self.api_token
-            ).validate_token():
+            if not self.validate_token():
                 raise ValueError("The provided API token is invalid.")
         else:
             if not os.path.exists(self.config_file_path):
@@ -28,15 +41,38 @@ class SccCredentialsService:
             else:
                 self.load_credentials()
 
-            if not TokenValidationService(
-                self.base_url, self.api_token
-            ).validate_token():
+            if not self.validate_token():
                 print(
                     "The API token in ~/.cisco-security.yaml is invalid. Please re-enter your credentials."
                 )
                 self.prompt_and_save_credentials()
 
+    def validate_token(self):
+        if self.validation_cache.get(self._validation_cache_key()) is not None:
+            return True
+        if not TokenValidationService(self.base_url, self.api_token).validate_token():
+            return False
+        self._cache_validation()
+        return True
+
+    def handle_unauthorized(self):
+        """
+        Called when a request made with the credentials is rejected with a 401, which
+        means a cached validation was stale. Re-prompts for credentials loaded from
+        the config file; credentials passed on the command line can't be fixed here.
+        """
+        self.validation_cache.delete(self._validation_cache_key())
+        if self.credentials_provided:
+            raise ValueError("The provided API token is invalid.")
+        print(
+            "The API token in ~/.cisco-security.yaml is invalid. Please re-enter your credentials."
+        )
+        self.prompt_and_save_credentials()
+
     def prompt_and_save_credentials(self):
+        # questionary is slow to import, so only do so when prompting
+        from utils.interactive_cli import get_region_and_api_token
+
         self.region, self.api_token = get_region_and_api_token()
         config = {"scc.region": self.region, "scc.api-token": self.api_token}
         with open(self.config_file_path, "w") as file:
@@ -61,3 +97,25 @@ class SccCredentialsService:
 
     def get_credentials(self):
         return self.api_token, self.base_url
+
+    def _validation_cache_key(self):
+        return digest(f"{self.base_url}:{self.api_token}")
+
+    def _cache_validation(self):
+        if self.validation_ttl_seconds <= 0:
+            return
+        validated_at = time.time()
+        try:
+            exp = jwt.decode(self.api_token, options={"verify_signature": False}).get(
+                "exp"
+            )
+        except jwt.InvalidTokenError:
+            exp = None
+        expires_at = validated_at + self.validation_ttl_seconds
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self.validation_cache.set(
+            self._validation_cache_key(),
+            {"validated_at": validated_at, "exp": exp},
+            expires_at=expires_at,
+        )
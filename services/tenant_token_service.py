@@ -0,0 +1,57 @@
+import jwt
+
+from services.msp_service import MspService
+from utils.file_cache import FileCache, digest
+
+
+class TenantTokenService:
+    """
+    Hands out API tokens for the API-only user in each managed tenant, reusing
+    tokens from an on-disk cache while they are still valid.
+    """
+
+    def __init__(
+        self,
+        msp_service: MspService,
+        msp_api_token: str,
+        token_cache: FileCache | None = None,
+        expiry_margin_seconds: int = 300,
+    ):
+        self.msp_service = msp_service
+        self.token_cache = token_cache
+        self.expiry_margin_seconds = expiry_margin_seconds
+        # never persist the MSP token itself; a digest is enough to tell portals apart
+        self.msp_token_digest = digest(msp_api_token)
+
+    def get_token(self, tenant_uid: str, tenant_name: str) -> str:
+        if self.token_cache is not None:
+            cached_token = self.token_cache.get(self._cache_key(tenant_uid))
+            if cached_token is not None:
+                return cached_token
+
+        api_token = self.msp_service.get_token_for_api_only_user(
+            tenant_uid=tenant_uid, tenant_name=tenant_name
+        )
+        if self.token_cache is not None:
+            self._cache_token(tenant_uid, api_token)
+        return api_token
+
+    def invalidate(self, tenant_uid: str) -> None:
+        """Forget the cached token for a tenant, e.g. after the API rejected it with a 401."""
+        if self.token_cache is not None:
+            self.token_cache.delete(self._cache_key(tenant_uid))
+
+    def _cache_key(self, tenant_uid: str) -> str:
+        return f"{self.msp_token_digest}:{tenant_uid}"
+
+    def _cache_token(self, tenant_uid: str, api_token: str) -> None:
+        try:
+            claims = jwt.decode(api_token, options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            # we can't tell when this token expires, so don't reuse it
+            return
+        # tokens without an expiry are reused until the API rejects them
+        expires_at = (
+            claims["exp"] - self.expiry_margin_seconds if "exp" in claims else None
+        )
+        self.token_cache.set(self._cache_key(tenant_uid), api_token, expires_at)
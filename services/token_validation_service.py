@@ -1,5 +1,6 @@
-from scc_firewall_manager_sdk import Configuration, ApiClient, UsersApi, \
-    ApiException
+from scc_firewall_manager_sdk import UsersApi, ApiException
+
+from utils.api_client_pool import create_api_client
 
 
 class TokenValidationService:
@@ -8,8 +9,7 @@ class TokenValidationService:
         self.api_token = api_token
 
     def validate_token(self):
-        configuration = Configuration(host=self.base_url, access_token=self.api_token)
-        with ApiClient(configuration) as api_client:
+        with create_api_client(self.base_url, self.api_token) as api_client:
             api_instance = UsersApi(api_client)
             try:
                 api_instance.get_token()
@@ -1,4 +1,9 @@
+import heapq
+import itertools
+import random
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 from scc_firewall_manager_sdk import TransactionsApi, CdoTransaction
 
@@ -10,18 +15,91 @@ class TransactionService:
     def wait_for_transaction_to_finish(
         self, transaction_uid: str, time_to_wait_between_retries_seconds: int = 5
     ) -> CdoTransaction:
-        transaction: CdoTransaction = self.transactions_api.get_transaction(
-            transaction_uid
+        """
+        Wait for a single transaction to finish. Polling starts fast and backs off to
+        at most time_to_wait_between_retries_seconds between polls.
+        """
+        for _, transaction, error in self.wait_for_transactions_to_finish(
+            [transaction_uid],
+            max_concurrency=1,
+            max_delay_seconds=time_to_wait_between_retries_seconds,
+        ):
+            if error is not None:
+                raise error
+            return transaction
+
+    def wait_for_transactions_to_finish(
+        self,
+        transaction_uids: Iterable[str],
+        max_concurrency: int = 8,
+        initial_delay_seconds: float = 0.5,
+        max_delay_seconds: float = 10,
+    ) -> Iterator[Tuple[str, CdoTransaction | None, Exception | None]]:
+        """
+        Poll many transactions together, with at most max_concurrency polls in flight.
+        The delay between polls of a transaction starts at initial_delay_seconds and
+        doubles (with jitter) up to max_delay_seconds. Yields a tuple of
+        (transaction UID, transaction, error) for each transaction as soon as it
+        finishes; error is set if the transaction failed or could not be polled.
+        """
+        # (time of next poll, tie-breaker, transaction UID, current delay)
+        schedule: List[Tuple[float, int, str, float]] = []
+        counter = itertools.count()
+        for transaction_uid in transaction_uids:
+            heapq.heappush(schedule, (0, next(counter), transaction_uid, 0))
+
+        in_flight: Dict[Future, Tuple[str, float]] = {}
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            while schedule or in_flight:
+                now = time.monotonic()
+                while (
+                    schedule
+                    and schedule[0][0] <= now
+                    and len(in_flight) < max_concurrency
+                ):
+                    _, _, transaction_uid, delay = heapq.heappop(schedule)
+                    future = executor.submit(
+                        self.transactions_api.get_transaction, transaction_uid
+                    )
+                    in_flight[future] = (transaction_uid, delay)
+
+                timeout = None
+                if schedule and len(in_flight) < max_concurrency:
+                    timeout = max(schedule[0][0] - time.monotonic(), 0)
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    transaction_uid, delay = in_flight.pop(future)
+                    try:
+                        transaction: CdoTransaction = future.result()
+                    except Exception as e:
+                        yield transaction_uid, None, e
+                        continue
+
+                    if transaction.cdo_transaction_status == "DONE":
+                        yield transaction_uid, transaction, None
+                    elif transaction.cdo_transaction_status == "ERROR":
+                        yield transaction_uid, transaction, self._get_transaction_error(
+                            transaction_uid, transaction
+                        )
+                    else:
+                        delay = min(
+                            max(delay * 2, initial_delay_seconds), max_delay_seconds
+                        )
+                        # jitter keeps transactions submitted together from being
+                        # polled in lockstep
+                        next_poll = time.monotonic() + random.uniform(delay / 2, delay)
+                        heapq.heappush(
+                            schedule, (next_poll, next(counter), transaction_uid, delay)
+                        )
+
+    @staticmethod
+    def _get_transaction_error(
+        transaction_uid: str, transaction: CdoTransaction
+    ) -> RuntimeError:
+        return RuntimeError(
+            f"Transaction {transaction_uid} failed: {transaction.transaction_details}. Error msg: {transaction.error_message}, error code: {transaction.error_details}"
         )
-        while transaction.cdo_transaction_status not in [
-            "DONE",
-            "ERROR",
-        ]:
-            time.sleep(time_to_wait_between_retries_seconds)
-            transaction = self.transactions_api.get_transaction(transaction_uid)
-
-        if transaction.cdo_transaction_status == "ERROR":
-            raise RuntimeError(
-                f"Transaction {transaction_uid} failed: {transaction.transaction_details}. Error msg: {transaction.error_message}, error code: {transaction.error_details}"
-            )
-        return transaction
@@ -0,0 +1,224 @@
+import socket
+import threading
+import time
+from typing import Dict
+
+from scc_firewall_manager_sdk import ApiClient, Configuration
+from scc_firewall_manager_sdk.rest import RESTClientObject
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from utils.api_profiler import ApiProfiler, get_endpoint, get_tenant_uid_from_url
+from utils.rate_limiter import RateLimiter, parse_retry_after
+from utils.retry_policy import (
+    CircuitBreaker,
+    RetryPolicy,
+    known_server_error_endpoints,
+)
+
+_lock = threading.Lock()
+_rest_clients: Dict[str, RESTClientObject] = {}
+_pool_maxsize: int = 16
+_keep_alive: bool = True
+_rate_limiter = RateLimiter()
+_max_throttled_retries = 5
+_profiler: ApiProfiler | None = None
+_request_timeout_seconds: float | None = 30
+_retry_policy = RetryPolicy()
+_circuit_breaker = CircuitBreaker()
+# retries are made by PooledApiClient, so urllib3 must not make its own
+_no_urllib3_retries = Retry(total=None, connect=0, read=0, status=0, other=0)
+
+
+class PooledApiClient(ApiClient):
+    """
+    An ApiClient whose requests all go through the process-wide rate limiter (and
+    profiler, if profiling is enabled), and which retries requests that the API
+    throttles with a 429, or that fail with a transient error according to the retry
+    policy. Requests have a timeout unless the caller sets one, and requests for a
+    tenant that keeps failing are cut short by the circuit breaker.
+    """
+
+    def __init__(self, configuration: Configuration, tenant_uid: str | None = None):
+        super().__init__(configuration)
+        self.tenant_uid = tenant_uid
+
+    def call_api(
+        self,
+        method,
+        url,
+        header_params=None,
+        body=None,
+        post_params=None,
+        _request_timeout=None,
+    ):
+        rate_limiter, retry_policy, circuit_breaker = (
+            _rate_limiter,
+            _retry_policy,
+            _circuit_breaker,
+        )
+        if _request_timeout is None:
+            _request_timeout = _request_timeout_seconds
+        tenant_uid = self.tenant_uid or get_tenant_uid_from_url(url)
+        throttled_retries = retries = 0
+        while True:
+            if tenant_uid:
+                circuit_breaker.check(tenant_uid)
+            rate_limiter.acquire()
+            try:
+                response = self._send(
+                    method, url, header_params, body, post_params, _request_timeout
+                )
+            except Exception as e:
+                rate_limiter.release()
+                if not retry_policy.should_retry_error(method, e):
+                    raise
+                if tenant_uid:
+                    circuit_breaker.record_failure(tenant_uid)
+                if retries == retry_policy.max_retries:
+                    raise
+                time.sleep(retry_policy.get_backoff_seconds(retries))
+                retries += 1
+                continue
+
+            throttled = response.status == 429
+            rate_limiter.release(
+                throttled,
+                (
+                    parse_retry_after(response.getheader("Retry-After"))
+                    if throttled
+                    else None
+                ),
+            )
+            if throttled:
+                if throttled_retries == _max_throttled_retries:
+                    return response
+                throttled_retries += 1
+                # read the response so that its connection goes back to the pool
+                response.read()
+                continue
+            if response.status < 500:
+                if tenant_uid:
+                    circuit_breaker.record_success(tenant_uid)
+                return response
+            if get_endpoint(method, url) in known_server_error_endpoints:
+                return response
+            if tenant_uid:
+                circuit_breaker.record_failure(tenant_uid)
+            if (
+                not retry_policy.should_retry_status(method, response.status)
+                or retries == retry_policy.max_retries
+            ):
+                return response
+            response.read()
+            time.sleep(retry_policy.get_backoff_seconds(retries))
+            retries += 1
+
+    def _send(self, method, url, *args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return super().call_api(method, url, *args, **kwargs)
+        started_at = time.monotonic()
+        tenant_uid = self.tenant_uid or get_tenant_uid_from_url(url)
+        try:
+            response = super().call_api(method, url, *args, **kwargs)
+            # the body is part of the cost of a request, and its size is recorded
+            response_bytes = len(response.read() or b"")
+        except Exception:
+            profiler.record(
+                get_endpoint(method, url),
+                tenant_uid,
+                time.monotonic() - started_at,
+                error=True,
+            )
+            raise
+        profiler.record(
+            get_endpoint(method, url),
+            tenant_uid,
+            time.monotonic() - started_at,
+            error=response.status >= 400,
+            response_bytes=response_bytes,
+        )
+        return response
+
+
+def configure_connection_pool(maxsize: int, keep_alive: bool = True) -> None:
+    """
+    Set the number of connections kept open per host, e.g. to match the number of
+    requests a command makes concurrently. Pools that already exist are resized.
+    """
+    global _pool_maxsize, _keep_alive
+    with _lock:
+        _pool_maxsize = maxsize
+        _keep_alive = keep_alive
+        for rest_client in _rest_clients.values():
+            rest_client.pool_manager.connection_pool_kw["maxsize"] = maxsize
+            # existing pools can't be resized; they are recreated on next use
+            rest_client.pool_manager.clear()
+
+
+def configure_rate_limiter(requests_per_second: float | None) -> None:
+    """
+    Cap the rate of requests made by all API clients. Without a cap, requests are only
+    slowed down once the API starts throttling them.
+    """
+    global _rate_limiter
+    _rate_limiter = RateLimiter(requests_per_second=requests_per_second)
+
+
+def configure_profiler(profiler: ApiProfiler | None) -> None:
+    """Record every request made by all API clients using profiler (None disables profiling)."""
+    global _profiler
+    _profiler = profiler
+
+
+def configure_retry_policy(
+    request_timeout_seconds: float | None, max_retries: int
+) -> None:
+    """
+    Set the timeout of requests that don't set their own (None waits forever), and
+    the number of times a request that fails with a transient error is retried.
+    """
+    global _request_timeout_seconds, _retry_policy
+    _request_timeout_seconds = request_timeout_seconds
+    _retry_policy = RetryPolicy(max_retries=max_retries)
+
+
+def configure_circuit_breaker(failure_threshold: int) -> None:
+    """Give up on a tenant after this many requests for it have failed in a row."""
+    global _circuit_breaker
+    _circuit_breaker = CircuitBreaker(failure_threshold=failure_threshold)
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    return _circuit_breaker
+
+
+def create_api_client(
+    base_url: str, access_token: str, tenant_uid: str | None = None
+) -> ApiClient:
+    """
+    Create an ApiClient that authenticates with access_token, but shares the
+    connections to base_url with every other client created by this function, so
+    that switching between tenants doesn't cost a new TLS handshake. The tenant_uid,
+    if the token is for a managed tenant, is used to attribute requests when profiling.
+    """
+    configuration = Configuration(host=base_url, access_token=access_token)
+    configuration.connection_pool_maxsize = _pool_maxsize
+    configuration.retries = _no_urllib3_retries
+    api_client = PooledApiClient(configuration, tenant_uid=tenant_uid)
+    api_client.rest_client = _get_rest_client(base_url, configuration)
+    return api_client
+
+
+def _get_rest_client(base_url: str, configuration: Configuration) -> RESTClientObject:
+    with _lock:
+        rest_client = _rest_clients.get(base_url)
+        if rest_client is None:
+            if _keep_alive:
+                configuration.socket_options = HTTPConnection.default_socket_options + [
+                    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                ]
+            rest_client = RESTClientObject(configuration)
+            _rest_clients[base_url] = rest_client
+        return rest_client
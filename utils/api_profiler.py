@@ -0,0 +1,185 @@
+import json
+import math
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+# upper bounds, in seconds, of the latency histogram buckets
+latency_buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf]
+
+profile_formats = ["json", "prometheus"]
+
+_uuid_pattern = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
+)
+_tenant_path_pattern = re.compile(r"/msp/tenants/([^/]+)")
+
+
+def get_endpoint(method: str, url: str) -> str:
+    """
+    Turn a request into the endpoint it called, e.g. 'GET /v1/transactions/{uid}', so
+    that requests for different objects are counted together.
+    """
+    path = urlparse(url).path
+    path = path[path.find("/v1/") :] if "/v1/" in path else path
+    segments = [
+        "{uid}" if _is_identifier(segment) else segment for segment in path.split("/")
+    ]
+    return f"{method} {'/'.join(segments)}"
+
+
+def get_tenant_uid_from_url(url: str) -> str | None:
+    """MSP endpoints that act on a managed tenant have the tenant's UID in their path."""
+    match = _tenant_path_pattern.search(urlparse(url).path)
+    return match.group(1) if match else None
+
+
+def _is_identifier(segment: str) -> bool:
+    # versioned path segments such as 'v1' are the only ones with digits that aren't UIDs
+    return bool(_uuid_pattern.fullmatch(segment)) or (
+        any(char.isdigit() for char in segment) and not re.fullmatch(r"v\d+", segment)
+    )
+
+
+@dataclass
+class EndpointStats:
+    count: int = 0
+    errors: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+    response_bytes: int = 0
+    bucket_counts: List[int] = field(default_factory=lambda: [0] * len(latency_buckets))
+
+    def add(self, stats: "EndpointStats") -> None:
+        self.count += stats.count
+        self.errors += stats.errors
+        self.total_seconds += stats.total_seconds
+        self.max_seconds = max(self.max_seconds, stats.max_seconds)
+        self.response_bytes += stats.response_bytes
+        self.bucket_counts = [
+            a + b for a, b in zip(self.bucket_counts, stats.bucket_counts)
+        ]
+
+    def get_quantile(self, quantile: float) -> float:
+        """Estimate a latency quantile from the histogram, as Prometheus does."""
+        if self.count == 0:
+            return 0
+        rank = quantile * self.count
+        cumulative_count = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if cumulative_count + bucket_count >= rank and bucket_count > 0:
+                lower_bound = latency_buckets[index - 1] if index > 0 else 0
+                upper_bound = min(latency_buckets[index], self.max_seconds)
+                if upper_bound <= lower_bound:
+                    return upper_bound
+                return lower_bound + (upper_bound - lower_bound) * (
+                    (rank - cumulative_count) / bucket_count
+                )
+            cumulative_count += bucket_count
+        return self.max_seconds
+
+
+class ApiProfiler:
+    """
+    Records the number of calls, errors, latency histogram and response size of the
+    API requests made by every thread, per endpoint and per tenant.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], EndpointStats] = {}
+
+    def record(
+        self,
+        endpoint: str,
+        tenant_uid: str | None,
+        seconds: float,
+        error: bool,
+        response_bytes: int = 0,
+    ) -> None:
+        bucket_index = next(
+            index for index, bound in enumerate(latency_buckets) if seconds <= bound
+        )
+        with self._lock:
+            stats = self._stats.setdefault(
+                (endpoint, tenant_uid or ""), EndpointStats()
+            )
+            stats.count += 1
+            stats.errors += int(error)
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.response_bytes += response_bytes
+            stats.bucket_counts[bucket_index] += 1
+
+    def get_stats_by_endpoint(self) -> Dict[str, EndpointStats]:
+        return self._aggregate(lambda key: key[0])
+
+    def get_stats_by_tenant(self) -> Dict[str, EndpointStats]:
+        return self._aggregate(lambda key: key[1])
+
+    def to_json(self) -> str:
+        with self._lock:
+            series = [
+                {
+                    "endpoint": endpoint,
+                    "tenant_uid": tenant_uid or None,
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "total_seconds": stats.total_seconds,
+                    "max_seconds": stats.max_seconds,
+                    "response_bytes": stats.response_bytes,
+                    "latency_buckets": {
+                        str(bound): count
+                        for bound, count in zip(latency_buckets, stats.bucket_counts)
+                    },
+                }
+                for (endpoint, tenant_uid), stats in self._stats.items()
+            ]
+        return json.dumps({"requests": series}, indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# TYPE scc_api_requests_total counter",
+            "# TYPE scc_api_request_errors_total counter",
+            "# TYPE scc_api_response_bytes_total counter",
+            "# TYPE scc_api_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (endpoint, tenant_uid), stats in sorted(self._stats.items()):
+                labels = f'endpoint="{endpoint}",tenant_uid="{tenant_uid}"'
+                lines.append(f"scc_api_requests_total{{{labels}}} {stats.count}")
+                lines.append(f"scc_api_request_errors_total{{{labels}}} {stats.errors}")
+                lines.append(
+                    f"scc_api_response_bytes_total{{{labels}}} {stats.response_bytes}"
+                )
+                cumulative_count = 0
+                for bound, count in zip(latency_buckets, stats.bucket_counts):
+                    cumulative_count += count
+                    le = "+Inf" if bound == math.inf else str(bound)
+                    lines.append(
+                        f'scc_api_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative_count}'
+                    )
+                lines.append(
+                    f"scc_api_request_duration_seconds_sum{{{labels}}} {stats.total_seconds}"
+                )
+                lines.append(
+                    f"scc_api_request_duration_seconds_count{{{labels}}} {stats.count}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_file: str, profile_format: str) -> None:
+        with open(output_file, "w", encoding="utf-8") as file:
+            file.write(
+                self.to_prometheus()
+                if profile_format == "prometheus"
+                else self.to_json()
+            )
+
+    def _aggregate(self, get_group) -> Dict[str, EndpointStats]:
+        aggregated: Dict[str, EndpointStats] = {}
+        with self._lock:
+            for key, stats in self._stats.items():
+                aggregated.setdefault(get_group(key), EndpointStats()).add(stats)
+        return aggregated
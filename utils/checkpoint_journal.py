@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+from typing import Dict, List
+
+
+class CheckpointJournal:
+    """
+    An append-only journal, one JSON object per line, of the tenants that have been
+    processed completely and the rows produced for them. Each entry is flushed to
+    disk as soon as it is recorded, so a run that is interrupted can be resumed from
+    the journal without repeating the tenants that were already done.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.completed_tenants: Dict[str, List[List[str]]] = (
+            self._load() if resume else {}
+        )
+        self._lock = threading.Lock()
+        self._file = open(path, mode="a" if resume else "w", encoding="utf-8")
+        if resume and self._file.tell() > 0 and not self._ends_with_newline():
+            # terminate a line left incomplete by an interrupted run, so that it
+            # doesn't swallow the next entry
+            self._file.write("\n")
+
+    def is_completed(self, tenant_uid: str) -> bool:
+        return tenant_uid in self.completed_tenants
+
+    def get_rows(self, tenant_uid: str) -> List[List[str]]:
+        return self.completed_tenants[tenant_uid]
+
+    def record(self, tenant_uid: str, rows: List[List[str]]) -> None:
+        with self._lock:
+            self._file.write(
+                json.dumps({"tenant_uid": tenant_uid, "rows": rows}) + "\n"
+            )
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.completed_tenants[tenant_uid] = rows
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def _load(self) -> Dict[str, List[List[str]]]:
+        completed_tenants = {}
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be incomplete if the previous run was killed
+                    # while writing it
+                    continue
+                completed_tenants[entry["tenant_uid"]] = entry["rows"]
+        return completed_tenants
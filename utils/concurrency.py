@@ -0,0 +1,37 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: int,
+    max_in_flight: int | None = None,
+) -> Iterator[R]:
+    """
+    Apply fn to items using a bounded pool of worker threads, yielding results in
+    the same order as the input, regardless of the order in which they finish.
+    At most max_in_flight items (all of them, if None) are submitted ahead of the
+    result being yielded; items are pulled from the iterable lazily.
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: Deque[Future] = deque()
+    iterator = iter(items)
+    try:
+        for item in iterator:
+            pending.append(executor.submit(fn, item))
+            if max_in_flight is not None and len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,175 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where writes from other processes can still be lost
+    fcntl = None
+
+default_cache_dir = "~/.cisco-security-cache"
+# caches with writes that haven't been flushed to their file yet
+_unflushed_caches: set = set()
+
+
+def digest(value: str) -> str:
+    """Used to key cache entries by secrets (such as API tokens) without persisting them."""
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class FileCache:
+    """
+    A small thread-safe key-value store persisted as a JSON file, with an optional
+    expiry time per entry. Entries that have expired are treated as missing and are
+    dropped the next time the file is written. If max_entries is set, the least
+    recently written entries are evicted once there are more than that.
+
+    Writes take effect in memory at once, but are only written to the file once
+    flush_every of them have been made, when flush is called, or when the process
+    exits; deletes are written right away. Several processes can share a cache file:
+    flushing holds a lock on the file while the writes are merged into its latest
+    contents, so that processes don't undo each other's writes.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        cache_dir: str = default_cache_dir,
+        max_entries: int | None = None,
+        flush_every: int | None = 1000,
+    ):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.path = os.path.join(self.cache_dir, file_name)
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._entries: dict | None = None
+        # the entries written since the last flush, with None for deleted entries
+        self._unflushed_entries: Dict[str, dict | None] = {}
+        # identifies the version of the file that _entries was read from or written to
+        self._file_version: tuple | None = None
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None or self._is_expired(entry):
+                return None
+            return entry["value"]
+
+    def set(self, key: str, value: Any, expires_at: float | None = None) -> None:
+        entry = {"value": value, "expires_at": expires_at}
+        with self._lock:
+            entries = self._load()
+            # re-insert the key so that the entries stay ordered by when they were written
+            entries.pop(key, None)
+            entries[key] = entry
+            self._unflushed_entries.pop(key, None)
+            self._unflushed_entries[key] = entry
+            _unflushed_caches.add(self)
+            should_flush = (
+                self.flush_every is not None
+                and len(self._unflushed_entries) >= self.flush_every
+            )
+        if should_flush:
+            self.flush()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._load().pop(key, None)
+            # the entry may be in the file even if it isn't in memory
+            self._unflushed_entries[key] = None
+        # deleted entries are typically stale or rejected, so other processes should
+        # stop using them right away
+        self.flush()
+
+    def flush(self) -> None:
+        """Write the entries written since the last flush to the file."""
+        with self._lock:
+            if self._unflushed_entries:
+                with self._lock_file():
+                    entries = self._load_latest()
+                    for key, entry in self._unflushed_entries.items():
+                        entries.pop(key, None)
+                        if entry is not None:
+                            entries[key] = entry
+                    self._save()
+                self._unflushed_entries = {}
+            _unflushed_caches.discard(self)
+
+    @staticmethod
+    def _is_expired(entry: dict) -> bool:
+        return entry["expires_at"] is not None and entry["expires_at"] <= time.time()
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as file:
+                    self._file_version = self._get_file_version(os.fstat(file.fileno()))
+                    self._entries = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def _load_latest(self) -> dict:
+        """Like _load, but first drop entries read before another process replaced the file."""
+        try:
+            file_version = self._get_file_version(os.stat(self.path))
+        except FileNotFoundError:
+            file_version = None
+        if file_version != self._file_version:
+            self._entries = None
+            self._file_version = None
+        return self._load()
+
+    @staticmethod
+    def _get_file_version(stat: os.stat_result) -> tuple:
+        # the file is always replaced rather than written in place, giving it a new inode
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _lock_file(self) -> Iterator[None]:
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        # the cache file itself is replaced on every write, so a separate file is locked
+        with open(
+            os.open(f"{self.path}.lock", os.O_WRONLY | os.O_CREAT, 0o600), "w"
+        ) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _save(self) -> None:
+        self._entries = {
+            key: entry
+            for key, entry in self._entries.items()
+            if not self._is_expired(entry)
+        }
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            evicted_keys = list(self._entries)[: len(self._entries) - self.max_entries]
+            for key in evicted_keys:
+                del self._entries[key]
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        # write to a temporary file and swap it in, so that a crash (or another
+        # process reading the cache) never sees a partially written file
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(
+            os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+            "w",
+            encoding="utf-8",
+        ) as file:
+            json.dump(self._entries, file)
+        os.replace(temp_path, self.path)
+        self._file_version = self._get_file_version(os.stat(self.path))
+
+
+@atexit.register
+def _flush_unflushed_caches() -> None:
+    for cache in list(_unflushed_caches):
+        cache.flush()
@@ -1,7 +1,7 @@
 import jwt
 import questionary
 
-from utils.region_mapping import supported_regions, supported_regions_choices
+from utils.region_mapping import get_supported_regions_choices, supported_regions
 
 
 def validate_region(region: str) -> bool:
@@ -19,7 +19,7 @@ def validate_api_token(api_token: str) -> bool:
 def get_region_and_api_token():
     try:
         region = questionary.select(
-            "Select the region:", choices=supported_regions_choices
+            "Select the region:", choices=get_supported_regions_choices()
         ).ask()
 
         if not validate_region(region):
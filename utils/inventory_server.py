@@ -0,0 +1,208 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.api_profiler import ApiProfiler
+from utils.inventory_store import (
+    InventoryStore,
+    device_columns,
+    tenant_columns,
+)
+from utils.output_writers import to_field_name
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ["1", "true", "yes"]:
+        return True
+    if value.lower() in ["0", "false", "no"]:
+        return False
+    raise ValueError(f"expected true or false, got '{value}'")
+
+
+# the query parameters of the device routes, with how to parse each one
+device_query_parameters = {
+    "software_version": str,
+    "model": str,
+    "tenant_uid": str,
+    "suggested_version": str,
+    "without_suggested_version": _parse_bool,
+}
+
+
+@dataclass
+class RefreshStatus:
+    """What the refresh loop has done so far, as reported by the health route."""
+
+    started_at: float
+    cycles: int = 0
+    last_cycle_started_at: float | None = None
+    last_cycle_finished_at: float | None = None
+    last_cycle_seconds: float | None = None
+    last_cycle_refreshed_tenants: int = 0
+    last_cycle_error: str | None = None
+
+
+class InventoryServer:
+    """
+    Serves the local inventory, as kept up to date by the serve command, over HTTP.
+    Requests are answered from the inventory database only, so they never cause any
+    requests to the API.
+
+    GET /tenants                 tenants with device counts and when they were refreshed
+    GET /devices                 devices, filtered by the same query parameters as the
+                                 options of `query devices`, e.g. ?software_version=7.0.6
+    GET /tenants/{uid}/devices   the devices in a tenant
+    GET /health                  the status of the refresh loop
+    GET /metrics                 refresh loop and API request metrics, in Prometheus format
+    """
+
+    def __init__(
+        self,
+        inventory_db: str,
+        refresh_status: RefreshStatus,
+        profiler: ApiProfiler | None = None,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+    ):
+        self.inventory_db = inventory_db
+        self.refresh_status = refresh_status
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        self.http_server = ThreadingHTTPServer(
+            (host, port),
+            type("RequestHandler", (_RequestHandler,), {"inventory_server": self}),
+        )
+        self.http_server.daemon_threads = True
+
+    def start(self) -> None:
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def shutdown(self) -> None:
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def update_refresh_status(self, **changes) -> None:
+        with self.lock:
+            for name, value in changes.items():
+                setattr(self.refresh_status, name, value)
+
+    def get_health(self) -> tuple[int, dict]:
+        with self.lock:
+            status = asdict(self.refresh_status)
+        if status["last_cycle_finished_at"] is None:
+            return 503, {"status": "starting", **status}
+        if status["last_cycle_error"] is not None:
+            return 200, {"status": "degraded", **status}
+        return 200, {"status": "ok", **status}
+
+    def get_metrics(self) -> str:
+        with self.lock:
+            status = asdict(self.refresh_status)
+        lines = [
+            "# TYPE scc_inventory_refresh_cycles_total counter",
+            f"scc_inventory_refresh_cycles_total {status['cycles']}",
+            "# TYPE scc_inventory_refresh_last_cycle_seconds gauge",
+            f"scc_inventory_refresh_last_cycle_seconds {status['last_cycle_seconds'] or 0}",
+            "# TYPE scc_inventory_refresh_last_cycle_tenants gauge",
+            f"scc_inventory_refresh_last_cycle_tenants {status['last_cycle_refreshed_tenants']}",
+            "# TYPE scc_inventory_refresh_last_cycle_finished_timestamp_seconds gauge",
+            f"scc_inventory_refresh_last_cycle_finished_timestamp_seconds {status['last_cycle_finished_at'] or 0}",
+        ]
+        metrics = "\n".join(lines) + "\n"
+        if self.profiler is not None:
+            metrics += self.profiler.to_prometheus()
+        return metrics
+
+
+class _BadRequestError(Exception):
+    pass
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    inventory_server: InventoryServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        try:
+            if path == "/health":
+                self.send_json(*self.inventory_server.get_health())
+            elif path == "/metrics":
+                self.send_text(200, self.inventory_server.get_metrics())
+            elif path == "/tenants":
+                self.send_json(200, self.query_tenants())
+            elif path == "/devices":
+                self.send_json(200, self.query_devices(query))
+            elif path.startswith("/tenants/") and path.endswith("/devices"):
+                tenant_uid = path.removeprefix("/tenants/").removesuffix("/devices")
+                self.send_json(
+                    200, self.query_devices({**query, "tenant_uid": tenant_uid})
+                )
+            else:
+                self.send_json(404, {"error": f"Not found: {path}"})
+        except _BadRequestError as e:
+            self.send_json(400, {"error": str(e)})
+        except sqlite3.OperationalError as e:
+            # e.g. the database stayed locked by the refresh loop for too long
+            self.send_json(503, {"error": f"The inventory is unavailable: {e}"})
+
+    def query_tenants(self) -> dict:
+        with self.open_inventory_store() as inventory_store:
+            tenants = to_dicts(tenant_columns, inventory_store.query_tenants())
+            refreshed_at = inventory_store.get_tenant_refresh_times()
+        now = time.time()
+        for tenant in tenants:
+            tenant["refreshed_at"] = refreshed_at.get(tenant["tenant_uid"])
+            tenant["age_seconds"] = (
+                round(now - tenant["refreshed_at"], 1)
+                if tenant["refreshed_at"] is not None
+                else None
+            )
+        return {"count": len(tenants), "items": tenants}
+
+    def query_devices(self, query: dict) -> dict:
+        unknown_names = sorted(set(query) - set(device_query_parameters))
+        if unknown_names:
+            raise _BadRequestError(
+                f"Unknown query parameters: {', '.join(unknown_names)}; expected "
+                f"{', '.join(device_query_parameters)}"
+            )
+        parameters = {}
+        for name, value in query.items():
+            try:
+                parameters[name] = device_query_parameters[name](value)
+            except ValueError as e:
+                raise _BadRequestError(f"Invalid value for {name}: {e}")
+        with self.open_inventory_store() as inventory_store:
+            devices = to_dicts(
+                device_columns, inventory_store.query_devices(**parameters)
+            )
+        return {"count": len(devices), "items": devices}
+
+    def open_inventory_store(self) -> InventoryStore:
+        # SQLite connections can't be shared between threads, so open one per request
+        return InventoryStore(self.inventory_server.inventory_db)
+
+    def send_json(self, status: int, body: dict):
+        self.send_text(status, json.dumps(body), "application/json")
+
+    def send_text(self, status: int, body: str, content_type: str = "text/plain"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def to_dicts(columns: list, rows: list) -> list:
+    field_names = [to_field_name(column) for column in columns]
+    return [dict(zip(field_names, row)) for row in rows]
@@ -0,0 +1,252 @@
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List
+
+default_inventory_db_path = "~/.cisco-security-cache/inventory.db"
+lock_timeout_seconds = 30
+
+device_columns = [
+    "Tenant Name",
+    "Tenant UID",
+    "Device Name",
+    "Device UID",
+    "Model",
+    "Software Version",
+    "Suggested Version",
+    "Upgrade Package UID",
+    "Refreshed At",
+]
+tenant_columns = [
+    "Tenant Name",
+    "Tenant UID",
+    "Devices",
+    "Devices With Suggested Version",
+    "Refreshed At",
+]
+
+_schema = """
+CREATE TABLE IF NOT EXISTS tenants (
+    uid TEXT PRIMARY KEY,
+    name TEXT,
+    display_name TEXT,
+    region TEXT,
+    devices_refreshed_at REAL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    uid TEXT PRIMARY KEY,
+    tenant_uid TEXT NOT NULL REFERENCES tenants (uid),
+    name TEXT,
+    device_type TEXT,
+    model TEXT,
+    software_version TEXT,
+    connectivity_state TEXT,
+    suggested_version TEXT,
+    upgrade_package_uid TEXT,
+    refreshed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_by_tenant ON devices (tenant_uid);
+CREATE INDEX IF NOT EXISTS devices_by_software_version ON devices (software_version);
+"""
+
+
+class InventoryStore:
+    """
+    A local SQLite database of the managed tenants, their FTD devices and the
+    suggested versions to upgrade them to, recording when each was last refreshed
+    from the API, so that questions about the fleet can be answered offline.
+    """
+
+    def __init__(self, path: str = default_inventory_db_path):
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or ".", mode=0o700, exist_ok=True)
+        # the serve command reads the database while it is being refreshed: in WAL mode,
+        # readers don't block the writer or each other, and a connection that does find
+        # the database locked waits for up to lock_timeout_seconds instead of failing
+        self.connection = sqlite3.connect(self.path, timeout=lock_timeout_seconds)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_schema)
+
+    def upsert_tenants(self, tenants: Iterable) -> None:
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO tenants (uid, name, display_name, region)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (uid) DO UPDATE SET
+                    name = excluded.name,
+                    display_name = excluded.display_name,
+                    region = excluded.region
+                """,
+                [
+                    (tenant.uid, tenant.name, tenant.display_name, tenant.region)
+                    for tenant in tenants
+                ],
+            )
+
+    def replace_tenant_devices(
+        self, tenant_uid: str, devices_with_suggested_versions: List[tuple]
+    ) -> None:
+        """
+        Replace the devices recorded for a tenant with the given (device, suggested
+        version) pairs, so that devices removed from the tenant disappear too.
+        """
+        refreshed_at = time.time()
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM devices WHERE tenant_uid = ?", (tenant_uid,)
+            )
+            self.connection.executemany(
+                """
+                INSERT OR REPLACE INTO devices (
+                    uid, tenant_uid, name, device_type, model, software_version,
+                    connectivity_state, suggested_version, upgrade_package_uid,
+                    refreshed_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        device.uid,
+                        tenant_uid,
+                        device.name,
+                        _to_str(device.device_type),
+                        device.model_number or device.hardware_model,
+                        device.software_version,
+                        _to_str(device.connectivity_state),
+                        (
+                            suggested_version.software_version
+                            if suggested_version
+                            else None
+                        ),
+                        (
+                            suggested_version.upgrade_package_uid
+                            if suggested_version
+                            else None
+                        ),
+                        refreshed_at,
+                    )
+                    for device, suggested_version in devices_with_suggested_versions
+                ],
+            )
+            self.connection.execute(
+                "UPDATE tenants SET devices_refreshed_at = ? WHERE uid = ?",
+                (refreshed_at, tenant_uid),
+            )
+
+    def get_stale_tenant_uids(
+        self, tenant_uids: Iterable[str], stale_after_seconds: float
+    ) -> List[str]:
+        """
+        Return the given tenants whose devices were last refreshed more than
+        stale_after_seconds ago, or never.
+        """
+        fresh_tenant_uids = {
+            row[0]
+            for row in self.connection.execute(
+                "SELECT uid FROM tenants WHERE devices_refreshed_at >= ?",
+                (time.time() - stale_after_seconds,),
+            )
+        }
+        return [
+            tenant_uid
+            for tenant_uid in tenant_uids
+            if tenant_uid not in fresh_tenant_uids
+        ]
+
+    def get_tenant_refresh_times(self) -> Dict[str, float]:
+        """Map the UID of each tenant that has been refreshed to when it last was."""
+        return dict(
+            self.connection.execute(
+                "SELECT uid, devices_refreshed_at FROM tenants "
+                "WHERE devices_refreshed_at IS NOT NULL"
+            )
+        )
+
+    def order_by_staleness(self, tenant_uids: Iterable[str]) -> List[str]:
+        """Sort the given tenants so that those refreshed longest ago (or never) come first."""
+        refresh_times = self.get_tenant_refresh_times()
+        return sorted(
+            tenant_uids, key=lambda tenant_uid: refresh_times.get(tenant_uid, 0)
+        )
+
+    def query_devices(
+        self,
+        software_version: str | None = None,
+        model: str | None = None,
+        tenant_uid: str | None = None,
+        suggested_version: str | None = None,
+        without_suggested_version: bool = False,
+    ) -> List[list]:
+        conditions, parameters = [], []
+        for column, value in [
+            ("devices.software_version", software_version),
+            ("devices.model", model),
+            ("devices.tenant_uid", tenant_uid),
+            ("devices.suggested_version", suggested_version),
+        ]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if without_suggested_version:
+            conditions.append("devices.suggested_version IS NULL")
+        return self._query(
+            f"""
+            SELECT tenants.display_name, devices.tenant_uid, devices.name, devices.uid,
+                devices.model, devices.software_version, devices.suggested_version,
+                devices.upgrade_package_uid, devices.refreshed_at
+            FROM devices JOIN tenants ON tenants.uid = devices.tenant_uid
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            ORDER BY tenants.display_name, devices.name
+            """,
+            parameters,
+        )
+
+    def query_tenants(self, without_suggested_upgrade: bool = False) -> List[list]:
+        return self._query(
+            f"""
+            SELECT tenants.display_name, tenants.uid, COUNT(devices.uid),
+                COUNT(devices.suggested_version), tenants.devices_refreshed_at
+            FROM tenants LEFT JOIN devices ON devices.tenant_uid = tenants.uid
+            WHERE tenants.devices_refreshed_at IS NOT NULL
+            GROUP BY tenants.uid
+            {"HAVING COUNT(devices.suggested_version) = 0" if without_suggested_upgrade else ""}
+            ORDER BY tenants.display_name
+            """,
+            [],
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _query(self, sql: str, parameters: list) -> List[list]:
+        return [list(row) for row in self.connection.execute(sql, parameters)]
+
+
+def to_text_row(row: list) -> List[str]:
+    """
+    Format a row returned by a query for CSV or table output: missing values become
+    empty strings, and the refresh time, which is always the last column, a local time.
+    """
+    return ["" if value is None else _to_str(value) for value in row[:-1]] + [
+        _format_time(row[-1])
+    ]
+
+
+def _to_str(value) -> str | None:
+    if value is None:
+        return None
+    # SDK enums are stored by value
+    return str(getattr(value, "value", value))
+
+
+def _format_time(timestamp: float | None) -> str:
+    if timestamp is None:
+        return ""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
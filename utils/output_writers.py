@@ -0,0 +1,148 @@
+import abc
+import csv
+import json
+from typing import List
+
+output_formats = ["csv", "jsonl", "parquet"]
+
+
+def to_field_name(column: str) -> str:
+    """Turn a column header such as 'Tenant UID' into a field name such as 'tenant_uid'."""
+    return column.lower().replace(" ", "_")
+
+
+class OutputWriter(abc.ABC):
+    """
+    Writes rows to an output file as they are produced, rather than all at once at
+    the end of a run, so that a crash part-way through keeps the rows written so far.
+    """
+
+    def __init__(self, output_file: str, columns: List[str]):
+        self.output_file = output_file
+        self.columns = columns
+
+    @abc.abstractmethod
+    def write_rows(self, rows: List[List[str]]) -> None:
+        pass
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvOutputWriter(OutputWriter):
+    def __init__(self, output_file: str, columns: List[str]):
+        super().__init__(output_file, columns)
+        self.file = open(output_file, mode="w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write_rows(self, rows: List[List[str]]) -> None:
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JsonlOutputWriter(OutputWriter):
+    def __init__(self, output_file: str, columns: List[str]):
+        super().__init__(output_file, columns)
+        self.field_names = [to_field_name(column) for column in columns]
+        self.file = open(output_file, mode="w", encoding="utf-8")
+
+    def write_rows(self, rows: List[List[str]]) -> None:
+        for row in rows:
+            self.file.write(json.dumps(dict(zip(self.field_names, row))) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetOutputWriter(OutputWriter):
+    """
+    Writes each batch of rows as a Parquet row group. Note that a Parquet file is
+    only readable once it has been closed.
+    """
+
+    def __init__(self, output_file: str, columns: List[str]):
+        super().__init__(output_file, columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError(
+                "Parquet output requires pyarrow. Install it using `pip install pyarrow`."
+            )
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [(to_field_name(column), pyarrow.string()) for column in columns]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(output_file, self.schema)
+
+    def write_rows(self, rows: List[List[str]]) -> None:
+        if not rows:
+            return
+        self.writer.write_table(
+            self.pyarrow.Table.from_pylist(
+                [dict(zip(self.schema.names, row)) for row in rows], schema=self.schema
+            )
+        )
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def create_output_writer(
+    output_format: str, output_file: str, columns: List[str]
+) -> OutputWriter:
+    if output_format == "csv":
+        return CsvOutputWriter(output_file, columns)
+    elif output_format == "jsonl":
+        return JsonlOutputWriter(output_file, columns)
+    elif output_format == "parquet":
+        return ParquetOutputWriter(output_file, columns)
+    raise ValueError(f"Unsupported output format: {output_format}")
+
+
+def get_output_format(output_file: str) -> str:
+    """Guess the format of an output file from its extension, defaulting to CSV."""
+    extension = output_file.rsplit(".", 1)[-1].lower()
+    return extension if extension in output_formats else "csv"
+
+
+def read_output_file(output_file: str, columns: List[str]) -> List[List[str]]:
+    """Read back the rows of an output file written by one of the writers above."""
+    output_format = get_output_format(output_file)
+    field_names = [to_field_name(column) for column in columns]
+    if output_format == "jsonl":
+        with open(output_file, "r", encoding="utf-8") as file:
+            return [
+                [json.loads(line).get(field_name, "") for field_name in field_names]
+                for line in file
+                if line.strip()
+            ]
+    if output_format == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError(
+                "Parquet input requires pyarrow. Install it using `pip install pyarrow`."
+            )
+        table = pyarrow.parquet.read_table(output_file, columns=field_names)
+        return [
+            [row[field_name] for field_name in field_names] for row in table.to_pylist()
+        ]
+    with open(output_file, "r", newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header != columns:
+            raise ValueError(f"{output_file} does not have the expected columns.")
+        return list(reader)
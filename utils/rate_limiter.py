@@ -0,0 +1,100 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header, which is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Limits the requests made by every thread in the process. A token bucket caps the
+    request rate (if requests_per_second is set), and the number of requests in
+    flight is adjusted using AIMD: it is halved when the API throttles a request and
+    grows by roughly one per round of requests that aren't throttled. Throttled
+    requests also pause every thread until the Retry-After time has passed.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float | None = None,
+        max_concurrency: int = 64,
+        min_concurrency: int = 1,
+        default_retry_after_seconds: float = 1,
+    ):
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.default_retry_after_seconds = default_retry_after_seconds
+        self.concurrency_limit = float(max_concurrency)
+        # allow bursts of up to one second's worth of requests
+        self._bucket_size = max(1.0, requests_per_second or 0)
+        self._tokens = self._bucket_size
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait_seconds = self._get_wait_seconds(now)
+                if wait_seconds == 0:
+                    break
+                # None waits until another request is released
+                self._condition.wait(timeout=wait_seconds)
+            if self.requests_per_second:
+                self._tokens -= 1
+            self._in_flight += 1
+
+    def release(self, throttled: bool = False, retry_after: float | None = None):
+        with self._condition:
+            now = time.monotonic()
+            if throttled:
+                # requests that were already in flight when the API started throttling
+                # are likely to be throttled too; only back off once per pause
+                if now >= self._paused_until:
+                    self.concurrency_limit = max(
+                        self.min_concurrency,
+                        min(self.concurrency_limit, self._in_flight) / 2,
+                    )
+                if retry_after is None:
+                    retry_after = self.default_retry_after_seconds
+                self._paused_until = max(self._paused_until, now + retry_after)
+            else:
+                self.concurrency_limit = min(
+                    self.max_concurrency,
+                    self.concurrency_limit + 1 / self.concurrency_limit,
+                )
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _refill(self, now: float) -> None:
+        if self.requests_per_second:
+            self._tokens = min(
+                self._bucket_size,
+                self._tokens + (now - self._refilled_at) * self.requests_per_second,
+            )
+        self._refilled_at = now
+
+    def _get_wait_seconds(self, now: float) -> float | None:
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= int(self.concurrency_limit):
+            return None
+        if self.requests_per_second and self._tokens < 1:
+            return (1 - self._tokens) / self.requests_per_second
+        return 0
@@ -1,23 +1,31 @@
-from questionary import Choice
+import os
 
 supported_regions = ["us", "eu", "au", "apj", "in", "int", "localhost"]
-supported_regions_choices = [
-    Choice(value="us", title="United States"),
-    Choice(value="eu", title="Europe"),
-    Choice(value="au", title="Australia"),
-    Choice(value="apj", title="Asia Pacific Japan"),
-    Choice(value="in", title="India"),
-    Choice(value="int", title="Staging (Cisco Developers only)"),
-    Choice(
-        value="localhost",
-        title="Localhost (Cisco Developers running Public API services only)",
-    ),
-]
+# lets the localhost region point at an API (such as the benchmarks' mock) on another port
+localhost_port_env_var = "SCC_LOCALHOST_PORT"
+
+
+def get_supported_regions_choices():
+    # questionary is slow to import, and only needed when prompting for a region
+    from questionary import Choice
+
+    return [
+        Choice(value="us", title="United States"),
+        Choice(value="eu", title="Europe"),
+        Choice(value="au", title="Australia"),
+        Choice(value="apj", title="Asia Pacific Japan"),
+        Choice(value="in", title="India"),
+        Choice(value="int", title="Staging (Cisco Developers only)"),
+        Choice(
+            value="localhost",
+            title="Localhost (Cisco Developers running Public API services only)",
+        ),
+    ]
 
 
 def get_scc_url(region):
     if region not in supported_regions:
         raise ValueError(f"Region {region} is not supported")
     elif region == "localhost":
-        return "http://localhost:3077"
+        return f"http://localhost:{os.environ.get(localhost_port_env_var, 3077)}"
     return f"https://api.{region}.security.cisco.com/firewall"
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from typing import Dict, List
+
+not_found_version = "Not found"
+
+
+@dataclass
+class TenantSummary:
+    tenant_name: str
+    devices: int = 0
+    devices_with_suggested_version: int = 0
+
+
+@dataclass
+class VersionSummary:
+    devices: int = 0
+    tenants: int = 0
+
+
+class SuggestedVersionSummary:
+    """
+    Counts of devices by tenant and by suggested version, kept instead of every row
+    of a run, so that what is shown at the end doesn't grow with the number of devices.
+    """
+
+    def __init__(self):
+        self.tenants: Dict[str, TenantSummary] = {}
+        self.versions: Dict[str, VersionSummary] = {}
+
+    def add_tenant_rows(self, tenant_name: str, tenant_uid: str, rows: List[List[str]]):
+        """Add the rows of one tenant, as written to the output file."""
+        tenant_summary = self.tenants.setdefault(tenant_uid, TenantSummary(tenant_name))
+        versions_in_tenant = set()
+        for row in rows:
+            version = row[4]
+            tenant_summary.devices += 1
+            if version != not_found_version:
+                tenant_summary.devices_with_suggested_version += 1
+            self.versions.setdefault(version, VersionSummary()).devices += 1
+            versions_in_tenant.add(version)
+        for version in versions_in_tenant:
+            self.versions[version].tenants += 1
+
+    @property
+    def device_count(self) -> int:
+        return sum(tenant.devices for tenant in self.tenants.values())
+
+    def get_top_tenants(self, top: int) -> List[TenantSummary]:
+        """The tenants with the most devices."""
+        return sorted(
+            self.tenants.values(),
+            key=lambda tenant: (-tenant.devices, tenant.tenant_name),
+        )[:top]
+
+    def get_versions(self) -> List[tuple]:
+        """(version, summary) pairs, with the most common versions first."""
+        return sorted(
+            self.versions.items(), key=lambda item: (-item[1].devices, item[0])
+        )
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from typing import Dict, List
+
+from scc_firewall_manager_sdk.exceptions import ApiException
+from urllib3.exceptions import (
+    ConnectTimeoutError,
+    HTTPError,
+    MaxRetryError,
+    NewConnectionError,
+)
+
+retryable_statuses = [500, 502, 503, 504]
+# requests that can be repeated without doing the work twice
+idempotent_methods = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+# endpoints that answer some requests with a server error that isn't transient, and
+# that the caller handles; these are neither retried nor held against the tenant
+known_server_error_endpoints = [
+    # see DeviceUpgradeService.get_suggested_compatible_version
+    "GET /v1/inventory/devices/ftds/{uid}/upgrades/versions",
+]
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request for a tenant that has been given up on."""
+
+    def __init__(self, tenant_uid: str):
+        super().__init__(
+            f"Gave up on tenant {tenant_uid} after repeated failed requests"
+        )
+        self.tenant_uid = tenant_uid
+
+
+# what a request can fail with once its retries are used up, as opposed to a bug
+request_errors = (ApiException, HTTPError, CircuitOpenError)
+
+
+class RetryPolicy:
+    """
+    Decides which failed requests are retried, and how long to back off before each
+    retry. Server errors and network errors are retried for idempotent requests;
+    other requests are only retried if they can't have been processed, i.e. if the
+    connection couldn't be made. Even a 503 may come from a proxy after the request
+    was passed on, so retrying a POST on one could e.g. add a user twice.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        initial_backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 8,
+    ):
+        self.max_retries = max_retries
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+    def should_retry_status(self, method: str, status: int) -> bool:
+        return status in retryable_statuses and method in idempotent_methods
+
+    def should_retry_error(self, method: str, error: Exception) -> bool:
+        return isinstance(error, HTTPError) and (
+            method in idempotent_methods or _is_connection_error(error)
+        )
+
+    def get_backoff_seconds(self, retry: int) -> float:
+        # full jitter, so that requests that failed together don't retry together
+        return random.uniform(
+            0,
+            min(self.max_backoff_seconds, self.initial_backoff_seconds * 2**retry),
+        )
+
+
+class CircuitBreaker:
+    """
+    Gives up on a tenant once failure_threshold requests for it in a row have failed
+    with a server or network error, so that one broken tenant doesn't hold up a run
+    with request after request that times out. Requests for the tenant then fail
+    immediately with a CircuitOpenError, until reset_after_seconds have passed; after
+    that, one successful request closes the circuit again, and one failed request
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_after_seconds: float = 300):
+        self.failure_threshold = failure_threshold
+        self.reset_after_seconds = reset_after_seconds
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def check(self, tenant_uid: str) -> None:
+        with self._lock:
+            opened_at = self._opened_at.get(tenant_uid)
+        if (
+            opened_at is not None
+            and time.monotonic() - opened_at < self.reset_after_seconds
+        ):
+            raise CircuitOpenError(tenant_uid)
+
+    def record_success(self, tenant_uid: str) -> None:
+        with self._lock:
+            self._failures.pop(tenant_uid, None)
+            self._opened_at.pop(tenant_uid, None)
+
+    def record_failure(self, tenant_uid: str) -> None:
+        with self._lock:
+            failures = self._failures.get(tenant_uid, 0) + 1
+            self._failures[tenant_uid] = failures
+            if failures >= self.failure_threshold:
+                self._opened_at[tenant_uid] = time.monotonic()
+
+    def get_open_tenant_uids(self) -> List[str]:
+        with self._lock:
+            return list(self._opened_at)
+
+
+def _is_connection_error(error: Exception) -> bool:
+    if isinstance(error, MaxRetryError):
+        error = error.reason
+    return isinstance(error, (NewConnectionError, ConnectTimeoutError))
@@ -0,0 +1,63 @@
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from typing import List, Tuple
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a shard such as '2/4' into its index, counting from 1, and the number of shards."""
+    try:
+        shard_index, shard_count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}', expected i/N, such as 1/4.")
+    if not 1 <= shard_index <= shard_count:
+        raise ValueError(
+            f"Invalid shard '{value}', i must be between 1 and the number of shards N."
+        )
+    return shard_index, shard_count
+
+
+def get_shard_index(tenant_uid: str, shard_count: int) -> int:
+    """
+    Get the shard, counting from 1, that a tenant belongs to. A tenant always belongs
+    to the same shard, no matter which process or host computes it, so shards can be
+    processed without any coordination.
+    """
+    # hash() is salted per process, so a stable hash is used instead
+    digest = hashlib.sha256(tenant_uid.lower().encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count + 1
+
+
+def select_shard(tenants: List, shard_index: int, shard_count: int) -> List:
+    return [
+        tenant
+        for tenant in tenants
+        if get_shard_index(tenant.uid, shard_count) == shard_index
+    ]
+
+
+def get_manifest_path(output_file: str) -> str:
+    return output_file + ".shard.json"
+
+
+@dataclass
+class ShardManifest:
+    """
+    Written next to the output file of a sharded run, so that merging the outputs can
+    tell which tenants should have been processed, including those without devices.
+    """
+
+    shard_index: int
+    shard_count: int
+    # the tenants selected across all shards, before sharding
+    selected_tenant_uids: List[str]
+    completed_tenant_uids: List[str]
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(asdict(self), file, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "ShardManifest":
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(**json.load(file))
@@ -0,0 +1,63 @@
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass
+class DeviceUpgrade:
+    tenant_name: str
+    tenant_uid: str
+    device_name: str
+    device_uid: str
+    version: str
+    upgrade_package_uid: str
+
+    @classmethod
+    def from_row(cls, row: List[str]) -> "DeviceUpgrade":
+        """Create an upgrade from a row of get-suggested-ftd-versions output."""
+        return cls(*row[:6])
+
+
+def plan_upgrade_waves(
+    upgrades: List[DeviceUpgrade], wave_size: int, max_per_tenant: int
+) -> List[List[DeviceUpgrade]]:
+    """
+    Split upgrades into waves of at most wave_size devices, with at most
+    max_per_tenant devices from any one tenant in a wave. Tenants take turns, so that
+    each wave spreads over as many tenants as possible instead of draining one tenant
+    before starting on the next. Each wave starts with the tenant after the last one
+    in the previous wave, so that when a wave can't fit every tenant, the same
+    tenants aren't always the ones left for the later waves.
+    """
+    upgrades_by_tenant_uid: Dict[str, deque] = {}
+    for upgrade in upgrades:
+        upgrades_by_tenant_uid.setdefault(upgrade.tenant_uid, deque()).append(upgrade)
+
+    tenant_uids = deque(upgrades_by_tenant_uid)
+    waves = []
+    while tenant_uids:
+        wave = []
+        devices_by_tenant_uid = Counter()
+        added = True
+        while added and len(wave) < wave_size:
+            added = False
+            for tenant_uid in tenant_uids:
+                if len(wave) >= wave_size:
+                    break
+                tenant_upgrades = upgrades_by_tenant_uid[tenant_uid]
+                if (
+                    not tenant_upgrades
+                    or devices_by_tenant_uid[tenant_uid] >= max_per_tenant
+                ):
+                    continue
+                wave.append(tenant_upgrades.popleft())
+                devices_by_tenant_uid[tenant_uid] += 1
+                added = True
+        waves.append(wave)
+        tenant_uids.rotate(-(tenant_uids.index(wave[-1].tenant_uid) + 1))
+        tenant_uids = deque(
+            tenant_uid
+            for tenant_uid in tenant_uids
+            if upgrades_by_tenant_uid[tenant_uid]
+        )
+    return waves